@@ -1,10 +1,10 @@
 import os
 
 from neomodel import (config, StructuredNode, StringProperty, RelationshipTo, DoesNotExist,
-                      StructuredRel, FloatProperty)
-from neomodel.properties import AliasProperty,Property
-from neomodel.relationship_manager import RelationshipDefinition
-config.DATABASE_URL = os.environ["NEO4J_BOLT_URL"]
+                      StructuredRel, FloatProperty, ArrayProperty)
+
+from relation_registry import RelationRegistry
+config.DATABASE_URL = os.environ.get("NEO4J_BOLT_URL", config.DATABASE_URL)
 
 
 class Synset(StructuredNode):
@@ -32,17 +32,9 @@ class RootWord(StructuredNode):
     name = StringProperty(unique_index=True, required=True)
     contains = RelationshipTo('Lemma', "CONTAINS")
     similar = RelationshipTo('RootWord', 'SIMILAR_TO', model=SubsetRel)
-    bert_is_next_to = RelationshipTo('RootWord', 'BERT_IS_NEXT_TO', model=SubsetRel)
-    bert_is_on_top_of = RelationshipTo('RootWord', 'BERT_IS_ON_TOP_OF', model=SubsetRel)
-    bert_is_underneath = RelationshipTo('RootWord', 'BERT_IS_UNDERNEATH', model=SubsetRel)
-    bert_is_inside = RelationshipTo('RootWord', 'BERT_IS_INSIDE', model=SubsetRel)
-    bert_is_bigger_than = RelationshipTo('RootWord', 'BERT_IS_BIGGER_THAN', model=SubsetRel)
-    bert_is_smaller_than = RelationshipTo('RootWord', 'BERT_IS_SMALLER_THAN', model=SubsetRel)
-    bert_they_verb = RelationshipTo('RootWord', 'BERT_THEY_VERB', model=SubsetRel)
-    bert_they_verb_on = RelationshipTo('RootWord', 'BERT_THEY_VERB_ON', model=SubsetRel)
-    bert_i_verb = RelationshipTo('RootWord', 'BERT_I_VERB', model=SubsetRel)
-    bert_i_verb_on = RelationshipTo('RootWord', 'BERT_I_VERB_ON', model=SubsetRel)
-    bert_is = RelationshipTo('RootWord', 'BERT_IS', model=SubsetRel)
+    # The BERT_* relationship types that have been written for this word
+    completed_relations = ArrayProperty(StringProperty())
+    # The BERT_* relationships are added from resources/relations by BERT_RELATIONS
 
 
 class Object(Synset):
@@ -53,6 +45,11 @@ class Object(Synset):
 class RootWordObject(RootWord):
     pass
 
+
+BERT_RELATIONS = RelationRegistry()
+BERT_RELATIONS.register(RootWord, SubsetRel)
+
+
 class ModelHelper:
 
     @staticmethod
@@ -124,36 +121,21 @@ class ModelHelper:
         return RootWord.nodes.get(name=lemma.name())
 
     @staticmethod
-    def newthing(orgfunction, addedstuff):
-        props = orgfunction(aliases=False,properties=False)
-        props.update(dict(
-            (name, property) for name, property in addedstuff.items()
-            if (False and isinstance(property, AliasProperty))
-            or (False and isinstance(property, Property)
-                and not isinstance(property, AliasProperty))
-            or (True and isinstance(property, RelationshipDefinition))
-        ))
-        return props
-
-    @staticmethod
-    def add_dynamic_relationship(node: StructuredNode, attribute, object_name, relationship_name):
-        value = RelationshipTo(object_name, relationship_name)
-        node.__setattr__(attribute, value)
-        #TODO: create lambda function and use kwargs properly
-        props = ModelHelper.newthing(node.defined_properties,
-                                     {attribute: value})
-        node.defined_properties = lambda **kwargs: props
-        node.__all_relationships__ = tuple(
-            node.defined_properties(aliases=False, properties=False).items()
-        )
-        for key, val in node.__all_relationships__:
-            node.__dict__[key] = val.build_manager(node, key)
-
-    @staticmethod
-    def add_dynamic_relationship_to_object(node, attribute, object_name, relationship_name):
-        value = RelationshipTo(object_name, relationship_name)
-        def __init__(self, *args, **kwargs):
-            self.super.__init__(*args, **kwargs)
-        news = type('Object1', (node,), {"__init__": __init__, attribute: value})
-        news.__label__ = "Object"
-        return news
+    def relationship_types():
+        """
+        Collects all the relationship types that are defined on the node models
+        :return: A dict mapping each relationship type to its (source label, target label,
+        property names)
+        """
+        types = {}
+        for node in (Synset, Lemma, RootWord):
+            for definition in node.defined_properties(aliases=False, properties=False).values():
+                target = definition._raw_class
+                if not isinstance(target, str):
+                    target = target.__name__
+                rel_model = definition.definition['model']
+                properties = [] if rel_model is None else \
+                    list(rel_model.defined_properties(aliases=False, rels=False).keys())
+                types.setdefault(definition.definition['relation_type'],
+                                 (node.__label__, target, properties))
+        return types
@@ -0,0 +1,310 @@
+import hashlib
+import os
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+"""
+Nearest neighbour indices over normalised word vectors that are used to find similar root words.
+The exact index compares every query with every candidate, the approximate ones trade recall
+for speed and can be saved to disk to be reused
+"""
+
+
+def normalise(vectors: np.ndarray) -> np.ndarray:
+    """
+    :param vectors: A matrix with one vector per row
+    :return: The rows scaled to unit length
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32)
+
+
+def fingerprint(vectors: np.ndarray) -> str:
+    """
+    :param vectors: The candidate vectors of an index
+    :return: A hash of their shape and values
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    digest = hashlib.sha1(str(vectors.shape).encode())
+    digest.update(vectors.tobytes())
+    return digest.hexdigest()
+
+
+def merge_topk(best: np.ndarray, best_scores: np.ndarray, candidates: np.ndarray,
+               scores: np.ndarray, topk: int):
+    """
+    Merges new candidates into the current top k of several queries
+    :param best: The current candidate indices, one row per query
+    :param best_scores: The current scores, one row per query
+    :param candidates: The new candidate indices, one row per query
+    :param scores: The scores of the new candidates
+    :param topk: The amount of neighbours that are kept
+    :return: The merged (indices, scores), sorted by descending score
+    """
+    all_ids = np.concatenate((best, candidates), axis=1)
+    all_scores = np.concatenate((best_scores, scores), axis=1)
+    rows = np.arange(all_ids.shape[0])[:, None]
+    keep = np.argpartition(-all_scores, topk - 1, axis=1)[:, :topk]
+    all_ids, all_scores = all_ids[rows, keep], all_scores[rows, keep]
+    order = np.argsort(-all_scores, axis=1)
+    return all_ids[rows, order], all_scores[rows, order]
+
+
+class ExactIndex:
+    """
+    Brute force search using blocked matrix multiplications
+    """
+
+    def __init__(self, vectors: np.ndarray, block_size: int = 1024):
+        """
+        :param vectors: Normalised candidate vectors, one per row
+        :param block_size: The amount of queries that are compared at once
+        """
+        self.vectors = vectors
+        self.block_size = block_size
+
+    def search_block(self, queries: np.ndarray, topk: int, exclude: np.ndarray):
+        scores = queries @ self.vectors.T
+        rows = np.arange(scores.shape[0])
+        mask = exclude >= 0
+        scores[rows[mask], exclude[mask]] = -np.inf
+        best = np.argpartition(-scores, topk - 1, axis=1)[:, :topk]
+        best_scores = scores[rows[:, None], best]
+        order = np.argsort(-best_scores, axis=1)
+        return best[rows[:, None], order], best_scores[rows[:, None], order]
+
+    def search(self, queries: np.ndarray, topk: int, exclude: np.ndarray = None):
+        """
+        Finds the candidates with the highest cosine similarity for every query
+        :param queries: Normalised query vectors, one per row
+        :param topk: The amount of neighbours per query
+        :param exclude: Optional candidate index per query that is never returned (-1 for none)
+        :return: Generator of (query index, candidate indices, scores) sorted by descending score
+        """
+        topk = min(topk, self.vectors.shape[0])
+        if exclude is None:
+            exclude = np.full(queries.shape[0], -1)
+        for start in range(0, queries.shape[0], self.block_size):
+            best, best_scores = self.search_block(queries[start:start + self.block_size], topk,
+                                                  exclude[start:start + self.block_size])
+            for row in range(best.shape[0]):
+                yield start + row, best[row], best_scores[row]
+
+
+class IvfIndex(ExactIndex):
+    """
+    Inverted file index: the candidates are clustered with k-means and a query is only compared
+    with the candidates of the nprobe clusters whose centroids are the most similar to it
+    """
+
+    def __init__(self, vectors: np.ndarray, block_size: int = 1024, nlist: int = None,
+                 nprobe: int = 8, iterations: int = 10, seed: int = 0):
+        """
+        :param vectors: Normalised candidate vectors, one per row
+        :param block_size: The amount of queries that are compared at once
+        :param nlist: The amount of clusters, defaults to 4 * sqrt(amount of candidates)
+        :param nprobe: The amount of clusters searched per query. Higher means better recall
+        :param iterations: The amount of k-means iterations
+        :param seed: The seed used to pick the initial centroids
+        """
+        super().__init__(vectors, block_size)
+        self.nprobe = nprobe
+        if nlist is None:
+            nlist = int(4 * np.sqrt(vectors.shape[0]))
+        self.nlist = max(1, min(nlist, vectors.shape[0]))
+        self.centroids = None
+        self.order = None
+        self.offsets = None
+        self.train(iterations, seed)
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        assignment = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], self.block_size):
+            scores = vectors[start:start + self.block_size] @ self.centroids.T
+            assignment[start:start + self.block_size] = scores.argmax(axis=1)
+        return assignment
+
+    def train(self, iterations: int, seed: int) -> None:
+        """
+        Clusters the candidates with spherical k-means and builds the inverted lists
+        """
+        rng = np.random.default_rng(seed)
+        self.centroids = self.vectors[rng.choice(self.vectors.shape[0], self.nlist,
+                                                 replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self.assign(self.vectors)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignment, self.vectors)
+            empty = np.bincount(assignment, minlength=self.nlist) == 0
+            sums[empty] = self.centroids[empty]
+            self.centroids = normalise(sums)
+        assignment = self.assign(self.vectors)
+        self.order = np.argsort(assignment, kind="stable")
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment,
+                                                                  minlength=self.nlist))))
+
+    def search_block(self, queries: np.ndarray, topk: int, exclude: np.ndarray):
+        nprobe = min(self.nprobe, self.nlist)
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        best = np.zeros((queries.shape[0], topk), dtype=np.int64)
+        best_scores = np.full((queries.shape[0], topk), -np.inf, dtype=np.float32)
+        for cluster in np.unique(probes):
+            rows = np.nonzero((probes == cluster).any(axis=1))[0]
+            members = self.order[self.offsets[cluster]:self.offsets[cluster + 1]]
+            if len(members) == 0:
+                continue
+            scores = queries[rows] @ self.vectors[members].T
+            scores[exclude[rows][:, None] == members[None, :]] = -np.inf
+            candidates = np.broadcast_to(members, scores.shape)
+            best[rows], best_scores[rows] = merge_topk(best[rows], best_scores[rows],
+                                                       candidates, scores, topk)
+        return best, best_scores
+
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as file:
+            np.savez(file, vectors=self.vectors, centroids=self.centroids, order=self.order,
+                     offsets=self.offsets, nprobe=self.nprobe)
+
+    @classmethod
+    def load(cls, path: str, block_size: int = 1024, nprobe: int = None):
+        data = np.load(path)
+        index = cls.__new__(cls)
+        ExactIndex.__init__(index, data["vectors"], block_size)
+        index.centroids = data["centroids"]
+        index.order = data["order"]
+        index.offsets = data["offsets"]
+        index.nlist = index.centroids.shape[0]
+        index.nprobe = int(data["nprobe"]) if nprobe is None else nprobe
+        return index
+
+
+class HnswIndex(ExactIndex):
+    """
+    Hierarchical navigable small world graph built with hnswlib
+    """
+
+    def __init__(self, vectors: np.ndarray, block_size: int = 1024, m: int = 16,
+                 ef_construction: int = 200, ef: int = 50, threads: int = -1):
+        """
+        :param vectors: Normalised candidate vectors, one per row
+        :param block_size: The amount of queries that are searched at once
+        :param m: The amount of links per node in the graph
+        :param ef_construction: The size of the candidate list while building the graph
+        :param ef: The size of the candidate list while searching. Higher means better recall
+        :param threads: The amount of threads used, -1 uses all cores
+        """
+        if hnswlib is None:
+            raise ImportError("The hnsw backend requires hnswlib to be installed")
+        super().__init__(vectors, block_size)
+        self.ef = ef
+        self.threads = threads
+        self.index = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        self.index.init_index(max_elements=vectors.shape[0], M=m,
+                              ef_construction=ef_construction)
+        self.index.add_items(vectors, num_threads=threads)
+
+    def search_block(self, queries: np.ndarray, topk: int, exclude: np.ndarray):
+        # One more neighbour than needed, in case the excluded word is among them
+        k = min(topk + 1, self.vectors.shape[0])
+        self.index.set_ef(max(self.ef, k))
+        labels, distances = self.index.knn_query(queries, k=k, num_threads=self.threads)
+        scores = (1 - distances).astype(np.float32)
+        scores[labels == exclude[:, None]] = -np.inf
+        return merge_topk(labels[:, :0].astype(np.int64), scores[:, :0], labels.astype(np.int64),
+                          scores, topk)
+
+    def save(self, path: str) -> None:
+        self.index.save_index(path)
+        # The graph doesn't hold the vectors it was built from, so they're identified by a hash
+        with open(f"{path}.sha1", 'w') as file:
+            file.write(fingerprint(self.vectors))
+
+    @staticmethod
+    def matches(path: str, vectors: np.ndarray) -> bool:
+        """
+        :return: True if the index saved at the path was built from these vectors
+        """
+        if not os.path.exists(f"{path}.sha1"):
+            return False
+        with open(f"{path}.sha1") as file:
+            return file.read().strip() == fingerprint(vectors)
+
+    @classmethod
+    def load(cls, path: str, vectors: np.ndarray, block_size: int = 1024, ef: int = 50,
+             threads: int = -1):
+        if hnswlib is None:
+            raise ImportError("The hnsw backend requires hnswlib to be installed")
+        index = cls.__new__(cls)
+        ExactIndex.__init__(index, vectors, block_size)
+        index.ef = ef
+        index.threads = threads
+        index.index = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        index.index.load_index(path, max_elements=vectors.shape[0])
+        return index
+
+
+def build_index(backend: str, vectors: np.ndarray, block_size: int = 1024, path: str = None,
+                nprobe: int = 8, ef: int = 50):
+    """
+    Builds the index of the given backend or loads it from the path if it has been saved there
+    before. A newly built approximate index is saved to the path
+    :param backend: One of exact, ivf or hnsw
+    :param vectors: Normalised candidate vectors, one per row
+    :param block_size: The amount of queries that are searched at once
+    :param path: Optional file the index is loaded from or saved to
+    :param nprobe: The amount of clusters searched per query by the ivf index
+    :param ef: The size of the candidate list while searching the hnsw index
+    :return: The index
+    """
+    if backend == "exact":
+        return ExactIndex(vectors, block_size)
+    if backend == "ivf":
+        if path is not None and os.path.exists(path):
+            index = IvfIndex.load(path, block_size, nprobe)
+            if np.array_equal(index.vectors, vectors):
+                return index
+        index = IvfIndex(vectors, block_size, nprobe=nprobe)
+    elif backend == "hnsw":
+        if path is not None and os.path.exists(path) and HnswIndex.matches(path, vectors):
+            return HnswIndex.load(path, vectors, block_size, ef)
+        index = HnswIndex(vectors, block_size, ef=ef)
+    else:
+        raise ValueError(f"Unknown index backend {backend}")
+    if path is not None:
+        index.save(path)
+    return index
+
+
+def recall(index, queries: np.ndarray, topk: int, sample: int = 1000, seed: int = 0,
+           exclude: np.ndarray = None) -> float:
+    """
+    Compares an index with the exact search on a random sample of the queries
+    :param index: The index that should be checked
+    :param queries: Normalised query vectors, one per row
+    :param topk: The amount of neighbours per query
+    :param sample: The amount of queries that are compared
+    :param seed: The seed used to draw the sample
+    :param exclude: Optional candidate index per query that is never returned (-1 for none)
+    :return: The fraction of the exact top k neighbours that the index found
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(queries.shape[0], min(sample, queries.shape[0]), replace=False)
+    sample_exclude = None if exclude is None else exclude[rows]
+    exact = ExactIndex(index.vectors, index.block_size)
+    found = 0
+    total = 0
+    for (_, expected, expected_scores), (_, approximate, approximate_scores) in zip(
+            exact.search(queries[rows], topk, sample_exclude),
+            index.search(queries[rows], topk, sample_exclude)):
+        # Padded slots of queries with fewer than topk neighbours have a score of -inf
+        expected = expected[np.isfinite(expected_scores)]
+        approximate = approximate[np.isfinite(approximate_scores)]
+        found += len(np.intersect1d(expected, approximate))
+        total += len(expected)
+    return found / total if total > 0 else 1.0
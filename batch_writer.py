@@ -0,0 +1,111 @@
+import random
+import time
+
+from neo4j.exceptions import TransientError
+from neomodel import db
+
+"""
+Collects relationships as parameter rows and writes them into the database in batches, using a
+single UNWIND statement per relationship type instead of one connect() per edge
+"""
+
+
+class RelationshipBatchWriter:
+
+    def __init__(self, batch_size: int = 5000, run_query=None, delete: bool = False):
+        """
+        :param batch_size: The amount of rows that are written per statement
+        :param run_query: A function taking a query and its params. Defaults to db.cypher_query
+        :param delete: Delete the queued relationships instead of merging them
+        """
+        self.batch_size = batch_size
+        self.run_query = run_query if run_query is not None else db.cypher_query
+        self.delete = delete
+        self.rows = {}
+        self.written = 0
+
+    @staticmethod
+    def build_query(source_label: str, relation_type: str, target_label: str,
+                    weighted: bool, delete: bool = False) -> str:
+        """
+        Builds the statement that merges one relationship per row between two existing nodes
+        :param source_label: The label of the start node
+        :param relation_type: The type of the relationship
+        :param target_label: The label of the end node
+        :param weighted: Whether the rows carry a weight that should be set on the relationship
+        :param delete: Build a statement deleting the relationships instead
+        :return: The cypher query
+        """
+        if delete:
+            return f"""UNWIND $rows AS row
+        MATCH (source:{source_label} {{name: row.source}})-[r:{relation_type}]->
+        (target:{target_label} {{name: row.target}})
+        DELETE r"""
+        query = f"""UNWIND $rows AS row
+        MATCH (source:{source_label} {{name: row.source}})
+        MATCH (target:{target_label} {{name: row.target}})
+        MERGE (source)-[r:{relation_type}]->(target)"""
+        if weighted:
+            query += "\n        SET r.weight = row.weight"
+        return query
+
+    def add(self, source_label: str, relation_type: str, target_label: str, source: str,
+            target: str, weight: float = None) -> None:
+        """
+        Queues a relationship between two nodes identified by their name. The batch of that
+        relationship type is written as soon as it's full
+        :param source_label: The label of the start node
+        :param relation_type: The type of the relationship
+        :param target_label: The label of the end node
+        :param source: The name of the start node
+        :param target: The name of the end node
+        :param weight: An optional weight of the relationship
+        """
+        key = (source_label, relation_type, target_label, weight is not None)
+        row = {"source": source, "target": target}
+        if weight is not None:
+            row["weight"] = weight
+        rows = self.rows.setdefault(key, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush_key(key)
+
+    def flush_key(self, key) -> None:
+        """
+        Writes all the queued rows of a single relationship type
+        :param key: The (source_label, relation_type, target_label, weighted) tuple
+        """
+        rows = self.rows.pop(key, [])
+        if len(rows) == 0:
+            return
+        # A consistent lock order makes deadlocks between concurrent writers less likely
+        rows.sort(key=lambda row: (row["source"], row["target"]))
+        self.run_query(self.build_query(*key, delete=self.delete), {"rows": rows})
+        self.written += len(rows)
+
+    def flush(self) -> None:
+        """
+        Writes all the queued rows
+        """
+        for key in list(self.rows.keys()):
+            self.flush_key(key)
+
+
+def retry_transient(run_query, retries: int = 5, backoff: float = 0.2):
+    """
+    Wraps a query function so transient errors, e.g. deadlocks between concurrent writers, are
+    retried with an exponential backoff
+    :param run_query: A function taking a query and its params
+    :param retries: How often a failing query is retried before the error is raised
+    :param backoff: The initial waiting time in seconds
+    :return: The wrapped function
+    """
+    def run(query, params=None):
+        for attempt in range(retries + 1):
+            try:
+                return run_query(query, params)
+            except TransientError:
+                if attempt == retries:
+                    raise
+                time.sleep(backoff * 2 ** attempt * (1 + random.random()))
+    return run
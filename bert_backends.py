@@ -0,0 +1,109 @@
+import os
+
+"""
+CPU inference backends for the masked language model used by FillMoreMaskPipeline. Besides the
+default fp32 PyTorch model the model can be dynamically quantised to int8 or exported to ONNX and
+run with ONNX Runtime. torch and onnxruntime are only imported once a backend is loaded
+"""
+
+BACKENDS = ["pt", "int8", "onnx"]
+
+
+class OnnxMaskedLM:
+    """
+    Runs an exported masked language model with ONNX Runtime on the CPU. It's called like the
+    PyTorch model and returns the logits as a torch tensor
+    """
+
+    def __init__(self, path: str, config, base_model_prefix: str, threads: int = 0):
+        """
+        :param path: The exported .onnx file
+        :param config: The config of the original model
+        :param base_model_prefix: The base model prefix of the original model
+        :param threads: The amount of threads used by ONNX Runtime, 0 lets it decide
+        """
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnx backend requires onnxruntime to be installed")
+        options = onnxruntime.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(path, options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.config = config
+        self.base_model_prefix = base_model_prefix
+
+    def __call__(self, **inputs):
+        import torch
+        feed = {name: tensor.cpu().numpy() for name, tensor in inputs.items()
+                if name in self.input_names}
+        return (torch.from_numpy(self.session.run(["logits"], feed)[0]),)
+
+
+def quantize(model):
+    """
+    :param model: A PyTorch masked language model
+    :return: A copy of the model whose linear layers use dynamic int8 quantisation
+    """
+    import torch
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def export_onnx(model, tokenizer, path: str) -> None:
+    """
+    Exports a masked language model to ONNX with a dynamic batch and sequence length
+    :param model: A PyTorch masked language model
+    :param tokenizer: The tokenizer of the model
+    :param path: The file the model is written to
+    """
+    import torch
+
+    class LogitsOnly(torch.nn.Module):
+        """
+        Wraps the model so it returns a plain logits tensor, which is needed for the export
+        """
+
+        def __init__(self, wrapped):
+            super().__init__()
+            self.model = wrapped
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask,
+                              token_type_ids=token_type_ids, return_dict=False)[0]
+
+    sample = tokenizer([f"The table is next to the {tokenizer.mask_token}."], return_tensors="pt")
+    input_names = [name for name in ["input_ids", "attention_mask", "token_type_ids"]
+                   if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["logits"]}
+    with torch.no_grad():
+        torch.onnx.export(LogitsOnly(model).eval(), tuple(sample[name] for name in input_names),
+                          path, input_names=input_names, output_names=["logits"],
+                          dynamic_axes=dynamic_axes, opset_version=14)
+
+
+def load_backend(backend: str, model, tokenizer, onnx_path: str = None, threads: int = 0):
+    """
+    Converts the fp32 PyTorch model to the given backend
+    :param backend: One of pt, int8 or onnx
+    :param model: The fp32 PyTorch masked language model
+    :param tokenizer: The tokenizer of the model
+    :param onnx_path: The file the ONNX model is loaded from, it's exported there if it's missing
+    :param threads: The amount of threads used for inference, 0 keeps the default
+    :return: The model that should be passed to the pipeline
+    """
+    import torch
+    if threads > 0:
+        torch.set_num_threads(threads)
+    if backend == "pt":
+        return model
+    if backend == "int8":
+        return quantize(model)
+    if backend == "onnx":
+        if onnx_path is None:
+            onnx_path = f"{model.config.name_or_path.replace('/', '_')}.onnx"
+        if not os.path.exists(onnx_path):
+            export_onnx(model, tokenizer, onnx_path)
+        return OnnxMaskedLM(onnx_path, model.config, model.base_model_prefix, threads)
+    raise ValueError(f"Unknown backend {backend}")
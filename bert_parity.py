@@ -0,0 +1,113 @@
+import argparse
+import time
+
+import numpy as np
+
+from bert_backends import BACKENDS
+from insert_bert_relations import RelationPrefab, SentenceBatcher, create_pipeline, get_tokenizer, \
+    select_framework
+
+"""
+Compares the predictions and the throughput of the inference backends with the fp32 PyTorch
+model on the relation templates
+"""
+
+DEFAULT_WORDS = ["table", "chair", "cup", "bottle", "book", "car", "bed", "lamp", "door",
+                 "window", "knife", "plate", "box", "bag", "shoe", "hat", "phone", "computer",
+                 "desk", "sofa", "clock", "pen", "bicycle", "guitar", "ball", "key", "mirror",
+                 "pillow", "basket", "bucket", "hammer", "spoon"]
+
+
+def run_backend(pipeline, batches: list, top_k: int):
+    """
+    Predicts all the batches with one pipeline
+    :param pipeline: The pipeline of the backend
+    :param batches: The batches created by SentenceBatcher
+    :param top_k: The amount of predictions per mask
+    :return: The predictions keyed by (word, relation name, mask) and the elapsed seconds
+    """
+    import torch
+    tokenizer = get_tokenizer()
+    predictions = {}
+    # Warm up so one time initialisation isn't counted
+    with torch.inference_mode():
+        pipeline([item["sentence"].format(mask=tokenizer.mask_token) for item in batches[0]],
+                 top_k=top_k)
+    start = time.time()
+    for batch in batches:
+        model_inputs = [item["sentence"].format(mask=tokenizer.mask_token) for item in batch]
+        with torch.inference_mode():
+            results = pipeline(model_inputs, top_k=top_k)
+        if len(batch) == 1:
+            results = [results]
+        for item, result in zip(batch, results):
+            for mask, mask_result in enumerate(result["mask_results"]):
+                predictions[(item["word"], item["relation_name"], mask)] = \
+                    {value["token_str"]: value["score"] for value in mask_result}
+    return predictions, time.time() - start
+
+
+def compare(baseline: dict, predictions: dict) -> dict:
+    """
+    :param baseline: The predictions of the fp32 model
+    :param predictions: The predictions of another backend
+    :return: The mean top k overlap and the mean and max score drift of the shared tokens
+    """
+    overlaps = []
+    drifts = []
+    for key, expected in baseline.items():
+        actual = predictions[key]
+        shared = expected.keys() & actual.keys()
+        overlaps.append(len(shared) / len(expected))
+        drifts += [abs(expected[token] - actual[token]) for token in shared]
+    return {"overlap": float(np.mean(overlaps)),
+            "mean_drift": float(np.mean(drifts)) if len(drifts) > 0 else float("nan"),
+            "max_drift": float(np.max(drifts)) if len(drifts) > 0 else float("nan")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the inference backends with the fp32 "
+                                                 "model")
+    parser.add_argument('-file', help="Specify the location of the relation file", required=True,
+                        metavar="PATH")
+    parser.add_argument('-backends', help="Comma separated backends compared to pt",
+                        default="int8,onnx")
+    parser.add_argument('-words', help="Comma separated words filled into the templates",
+                        default=",".join(DEFAULT_WORDS))
+    parser.add_argument('-top-k', help="Amount of predictions per mask", default=5, type=int,
+                        dest="top_k")
+    parser.add_argument('-batch-size', help="Maximal amount of sentences per inference batch",
+                        default=64, type=int, dest="batch_size")
+    parser.add_argument('-onnx-path', help="File the ONNX model is loaded from or exported to",
+                        dest="onnx_path", metavar="ONNXPATH")
+    parser.add_argument('-threads', help="Amount of threads used for inference", default=0,
+                        type=int)
+    args = parser.parse_args()
+    # The backends are all PyTorch based
+    select_framework("pt")
+
+    backends = [backend for backend in args.backends.split(",") if backend != "pt"]
+    unknown = [backend for backend in backends if backend not in BACKENDS]
+    if len(unknown) > 0:
+        parser.error(f"Unknown backends: {','.join(unknown)}")
+
+    batcher = SentenceBatcher(RelationPrefab(args.file), args.batch_size)
+    batches = list(batcher.batches(args.words.split(",")))
+    sentences = sum(len(batch) for batch in batches)
+
+    baseline, baseline_time = run_backend(
+        create_pipeline("pt", threads=args.threads, framework="pt"), batches, args.top_k)
+    print(f"pt: {sentences / baseline_time:.1f} sentences/s")
+    for backend in backends:
+        pipeline = create_pipeline(backend, onnx_path=args.onnx_path, threads=args.threads,
+                                   framework="pt")
+        predictions, elapsed = run_backend(pipeline, batches, args.top_k)
+        result = compare(baseline, predictions)
+        print(f"{backend}: {sentences / elapsed:.1f} sentences/s "
+              f"({baseline_time / elapsed:.2f}x), top {args.top_k} overlap "
+              f"{result['overlap']:.4f}, mean score drift {result['mean_drift']:.5f}, "
+              f"max score drift {result['max_drift']:.5f}")
+
+
+if __name__ == "__main__":
+    main()
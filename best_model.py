@@ -1,20 +1,16 @@
-import numpy as np
-from ampligraph.latent_features import ComplEx
-from ampligraph.evaluation import train_test_split_no_unseen, select_best_model_ranking
-from io import StringIO
-import pandas as pd
 import argparse
-from best_model_params import param_grid
+import json
+from thread_limits import limit_threads
 """
 Script to find a possible optimal model for a rela
 """
 parser = argparse.ArgumentParser(description="Evaluate a given graph database")
 parser.add_argument('-relations', help="Specify the file location of the various relations "
-                                       "between nodes", required=True,
-                    metavar="RPATH")
+                                       "between nodes, a csv or a .npy triple file",
+                    required=True, metavar="RPATH")
 parser.add_argument('-word-filter', help="Specify the nodes/words that should be masked over for "
-                                         "evaluation", required=True, metavar="FPATH",
-                    dest="word_filter")
+                                         "evaluation, a csv or a .npy file", required=True,
+                    metavar="FPATH", dest="word_filter")
 parser.add_argument('-max-combinations', help="Specifies the maximum amount of combinations of "
                                               "different model parameters that should be tried",
                     required=True, type=int, dest="max_combinations", metavar="AMOUNT")
@@ -22,58 +18,55 @@ parser.add_argument('-early-stopping', help="Should early stopping be used", met
                     type=bool, required=False, dest='early_stopping', default=False)
 parser.add_argument('-v', help="Verbose output for evaluation", required=False,
                     metavar="VERBOSE", dest="verbose", default=False, type=bool)
+parser.add_argument('-split-seed', help="Seed of the train/valid/test split", default=0,
+                    type=int, dest="split_seed")
+parser.add_argument('-split-cache', help="Directory the splits are cached in", default="splits",
+                    dest="split_cache")
+parser.add_argument('-model-config', help="Optional model config file whose "
+                                          "early_stopping_params are used, missing ones fall "
+                                          "back to early_stopping.DEFAULTS", required=False,
+                    metavar="MCFG", dest="model_config")
+parser.add_argument('-seed', help="Seed used to draw the configurations", default=0, type=int)
+parser.add_argument('-workers', help="Amount of processes training configurations", default=1,
+                    type=int)
+parser.add_argument('-threads', help="Amount of threads per process", default=1, type=int)
+parser.add_argument('-results-log', help="File every finished trial is appended to, trials in it "
+                                         "are skipped", default="search_results.jsonl",
+                    dest="results_log")
+parser.add_argument('-halving-min-epochs', help="Epochs of the first successive halving rung, "
+                                                "by default every configuration is trained fully",
+                    default=None, type=int, dest="halving_min_epochs")
+parser.add_argument('-halving-eta', help="Only the best 1/ETA configurations advance to the next "
+                                         "rung", default=3, type=int, dest="halving_eta")
 args = parser.parse_args()
+# Only effective before numpy is imported, the worker processes inherit the limit
+limit_threads(args.threads)
 
-with open(args.relations) as file:
-    data = file.read()
-    pdata = pd.read_csv(StringIO(data), delimiter=',').values
-    X_train_valid, X_train = train_test_split_no_unseen(pdata, test_size=0.7)
-    X_valid, X_test = train_test_split_no_unseen(X_train_valid, test_size=0.5,
-                                                 allow_duplication=True)
-    X = {'train': X_train,
-         'valid': X_valid,
-         'test': X_test}
-
-with open(args.word_filter) as file:
-    data = file.read()
-    pdata = pd.read_csv(StringIO(data), delimiter=',').values.squeeze()
+from best_model_params import param_grid
+from hyperparameter_search import SearchRunner, sample_configurations
+from triple_store import load_triples
+from splits import cached_splits
 
-filter_triples = np.concatenate((X['train'], X['valid'], X['test']))
+# Create the splits once, the workers only load them
+triples, relation_names = load_triples(args.relations)
+cached_splits(triples, args.split_seed, args.split_cache)
 
-early_stopping_params = {
-    'x_valid': X['valid'][::20],
-    'criteria': 'mrr',
-    'x_filter': filter_triples,
-    'corruption_entities': pdata,
-    'stop_interval': 4,
-    'burn_in': 0,
-    'check_interval': 50
-}
+early_stopping_settings = {}
+if args.model_config is not None:
+    with open(args.model_config, "r") as file:
+        early_stopping_settings.update(json.load(file).get("early_stopping_params", {}))
 
-if args.early_stopping:
-    best_model, best_params, best_mrr_train, ranks_test, test_evaluation = \
-        select_best_model_ranking(ComplEx, X['train'], X['valid'][::20], X['test'][:2000],
-                                  param_grid,
-                                  max_combinations=args.max_combinations,
-                                  entities_subset=pdata,
-                                  use_filter=True,
-                                  verbose=args.verbose,
-                                  early_stopping=True,
-                                  early_stopping_params=early_stopping_params)
-else:
-    best_model, best_params, best_mrr_train, ranks_test, test_evaluation = \
-        select_best_model_ranking(ComplEx, X['train'], X['valid'][::20], X['test'][:2000],
-                                  param_grid,
-                                  max_combinations=args.max_combinations,
-                                  entities_subset=pdata,
-                                  use_filter=True,
-                                  verbose=args.verbose)
+data = {"relations": args.relations, "word_filter": args.word_filter,
+        "split_seed": args.split_seed, "split_cache": args.split_cache,
+        "early_stopping": args.early_stopping, "evaluation_step": 20, "test_limit": 2000,
+        "verbose": args.verbose,
+        "early_stopping_params": early_stopping_settings}
+runner = SearchRunner(data, args.results_log, args.workers, args.threads,
+                      args.halving_min_epochs, args.halving_eta, triples)
+result = runner.search(sample_configurations(param_grid, args.max_combinations, args.seed))
 
 print({
-    "bestModel": best_model,
-    "bestParams": best_params,
-    "bestMRR": best_mrr_train,
-    "ranksTest": ranks_test,
-    "testEval": test_evaluation,
+    "bestParams": result["bestParams"],
+    "bestMRR": result["bestValid"]["mrr"],
+    "testEval": {key: result["testEval"][key] for key in ["mr", "mrr", "H@1", "H@3", "H@10"]},
 })
-
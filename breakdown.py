@@ -0,0 +1,157 @@
+import argparse
+import json
+
+import numpy as np
+
+"""
+Evaluation metrics grouped by relation, relation family and corrupted side. The ranks are
+streamed through once: every block only adds its counts, rank sums, reciprocal rank sums and hits
+per relation id and side, and the families and totals are summed up from those at the end
+"""
+
+SIDES = {"s": "head", "o": "tail"}
+
+
+def relation_family(name: str) -> str:
+    """
+    :param name: A relation type like HAS_HYPERNYM or BERT_IS_ON_TOP_OF
+    :return: bert, similar or wordnet
+    """
+    if name.startswith("BERT_"):
+        return "bert"
+    if name == "SIMILAR_TO":
+        return "similar"
+    return "wordnet"
+
+
+class GroupedMetrics:
+
+    def __init__(self, relation_names: list, corrupt_side: str = "s,o", hits: tuple = (1, 3, 10)):
+        """
+        :param relation_names: The relation names of the relation ids used in the triples
+        :param corrupt_side: The corrupted sides, one rank column each
+        :param hits: The n of the reported hits@n
+        """
+        self.relation_names = list(relation_names)
+        self.sides = corrupt_side.split(",")
+        self.hits = hits
+        shape = (len(self.relation_names), len(self.sides))
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.rank_sum = np.zeros(shape, dtype=np.float64)
+        self.reciprocal_sum = np.zeros(shape, dtype=np.float64)
+        self.hit_count = np.zeros((len(hits),) + shape, dtype=np.int64)
+
+    def update(self, triples: np.ndarray, ranks: np.ndarray) -> None:
+        """
+        :param triples: A block of ranked triples
+        :param ranks: Their ranks, one column per corrupted side
+        """
+        relations = np.asarray(triples)[:, 1].astype(np.int64)
+        ranks = np.asarray(ranks, dtype=np.float64).reshape(len(relations), len(self.sides))
+        size = len(self.relation_names)
+        for column in range(len(self.sides)):
+            side_ranks = ranks[:, column]
+            self.count[:, column] += np.bincount(relations, minlength=size)
+            self.rank_sum[:, column] += np.bincount(relations, side_ranks, size)
+            self.reciprocal_sum[:, column] += np.bincount(relations, 1 / side_ranks, size)
+            for i, n in enumerate(self.hits):
+                self.hit_count[i, :, column] += np.bincount(relations[side_ranks <= n],
+                                                            minlength=size)
+
+    def summary(self, relations: np.ndarray, columns: list) -> dict:
+        """
+        :param relations: The relation ids of the group
+        :param columns: The side columns of the group
+        :return: The count, mean rank, mean reciprocal rank and hits@n of the group
+        """
+        cells = np.ix_(relations, columns)
+        count = int(self.count[cells].sum())
+        result = {"count": count}
+        if count == 0:
+            return result
+        result["mr"] = float(self.rank_sum[cells].sum() / count)
+        result["mrr"] = float(self.reciprocal_sum[cells].sum() / count)
+        result.update({f"H@{n}": float(self.hit_count[i][cells].sum() / count)
+                       for i, n in enumerate(self.hits)})
+        return result
+
+    def group(self, relations: np.ndarray) -> dict:
+        """
+        :return: The metrics of the relations over all sides and per side
+        """
+        result = self.summary(relations, list(range(len(self.sides))))
+        result["sides"] = {SIDES[side]: self.summary(relations, [column])
+                           for column, side in enumerate(self.sides)}
+        return result
+
+    def to_dict(self) -> dict:
+        """
+        :return: The metrics overall, per relation family and per relation. Relations without
+        ranked triples are left out
+        """
+        relations = np.arange(len(self.relation_names))
+        ranked = self.count.sum(axis=1) > 0
+        families = np.array([relation_family(name) for name in self.relation_names])
+        return {
+            "overall": self.group(relations),
+            "families": {str(family): self.group(relations[(families == family) & ranked])
+                         for family in sorted(set(families[ranked]))},
+            "relations": {self.relation_names[relation]: self.group(np.array([relation]))
+                          for relation in relations[ranked]}
+        }
+
+    def save(self, path: str, **info) -> None:
+        """
+        Writes the metrics as json with sorted keys, so two runs can be diffed
+        :param path: The output file
+        :param info: Additional entries like the ranking method
+        """
+        with open(path, 'w') as file:
+            json.dump(dict(self.to_dict(), **info), file, indent=2, sort_keys=True)
+            file.write("\n")
+
+
+def groups(breakdown: dict) -> dict:
+    """
+    :param breakdown: A saved breakdown
+    :return: A dict mapping the name of every group and side to its metrics
+    """
+    flat = {"overall": breakdown["overall"]}
+    for kind in ["families", "relations"]:
+        for name, metrics in breakdown[kind].items():
+            flat[name] = metrics
+    for name, metrics in list(flat.items()):
+        for side, side_metrics in metrics.get("sides", {}).items():
+            flat[f"{name} ({side})"] = side_metrics
+    return flat
+
+
+def compare(before_path: str, after_path: str, metric: str = "mrr") -> None:
+    """
+    Prints the groups of two breakdowns ordered by the change of a metric
+    """
+    with open(before_path) as file:
+        before = groups(json.load(file))
+    with open(after_path) as file:
+        after = groups(json.load(file))
+    changes = [(name, before[name].get(metric), after[name].get(metric))
+               for name in sorted(set(before) & set(after))
+               if metric in before[name] and metric in after[name]]
+    for name, old, new in sorted(changes, key=lambda change: change[2] - change[1]):
+        print(f"{name:<40} {old:10.4f} {new:10.4f} {new - old:+10.4f}")
+    for name in sorted(set(before) ^ set(after)):
+        print(f"{name:<40} only in {'before' if name in before else 'after'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the breakdowns of two evaluation runs")
+    parser.add_argument("before", help="The breakdown json of the first run")
+    parser.add_argument("after", help="The breakdown json of the second run")
+    parser.add_argument("-metric", help="The compared metric", default="mrr",
+                        choices=["mr", "mrr", "H@1", "H@3", "H@10"])
+    args = parser.parse_args()
+    compare(args.before, args.after, args.metric)
+
+
+if __name__ == '__main__':
+    main()
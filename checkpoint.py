@@ -0,0 +1,66 @@
+import json
+import os
+
+"""
+Keeps track of how far a multi stage insertion got, so an interrupted run can be resumed
+"""
+
+
+class Checkpoint:
+
+    def __init__(self, path: str):
+        """
+        :param path: The file the checkpoint is stored in
+        """
+        self.path = path
+        self.state = {"completed": [], "stage": None, "offset": 0}
+
+    def load(self) -> None:
+        """
+        Loads the checkpoint from its file if it exists
+        """
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                self.state = json.load(file)
+
+    def save(self) -> None:
+        """
+        Writes the checkpoint to a temporary file first so a crash never leaves a broken file
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(self.state, file)
+        os.replace(tmp_path, self.path)
+
+    def is_completed(self, stage: str) -> bool:
+        return stage in self.state["completed"]
+
+    def start_offset(self, stage: str) -> int:
+        """
+        :param stage: The name of a stage
+        :return: The offset the stage should continue from
+        """
+        if self.state["stage"] == stage:
+            return self.state["offset"]
+        return 0
+
+    def commit(self, stage: str, offset: int) -> None:
+        """
+        Records that everything of the stage before the offset has been written
+        :param stage: The name of the stage
+        :param offset: The offset of the first item that hasn't been written yet
+        """
+        self.state["stage"] = stage
+        self.state["offset"] = offset
+        self.save()
+
+    def complete(self, stage: str) -> None:
+        """
+        Records that a stage has finished
+        :param stage: The name of the stage
+        """
+        if stage not in self.state["completed"]:
+            self.state["completed"].append(stage)
+        self.state["stage"] = None
+        self.state["offset"] = 0
+        self.save()
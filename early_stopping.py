@@ -0,0 +1,64 @@
+import time
+
+"""
+Early stopping settings for training ComplEx. The validation sample and the check cadence come
+from the early_stopping_params of the model config, and the filter only holds the known triples
+that can actually corrupt a validation triple, so a check doesn't have to search all of them
+"""
+
+DEFAULTS = {
+    "valid_size": None,
+    "valid_step": 2,
+    "criteria": "mrr",
+    "stop_interval": 4,
+    "burn_in": 0,
+    "check_interval": 50
+}
+
+
+def early_stopping_params(config: dict, X: dict, entities, index) -> dict:
+    """
+    :param config: The model config, its optional early_stopping_params override DEFAULTS.
+    valid_size takes the first triples of the (shuffled) valid split, otherwise every valid_step
+    th triple is used
+    :param X: The train, valid and test splits
+    :param entities: The entities used for the corruptions
+    :param index: The FilterIndex of all known triples
+    :return: The early_stopping_params passed to ampligraph's fit
+    """
+    settings = dict(DEFAULTS, **config.get("early_stopping_params", {}))
+    if settings["valid_size"] is not None:
+        valid = X["valid"][:settings["valid_size"]]
+    else:
+        valid = X["valid"][::settings["valid_step"]]
+    return {
+        'x_valid': valid,
+        'criteria': settings["criteria"],
+        'x_filter': index.filter_for(valid),
+        'corruption_entities': entities,
+        'stop_interval': settings["stop_interval"],
+        'burn_in': settings["burn_in"],
+        'check_interval': settings["check_interval"]
+    }
+
+
+def timed(model_class):
+    """
+    :param model_class: An ampligraph model class like ComplEx
+    :return: A subclass that adds up the seconds spent in early stopping checks in check_seconds
+    """
+    class TimedModel(model_class):
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.check_seconds = 0.0
+
+        def _perform_early_stopping_test(self, epoch):
+            start = time.time()
+            try:
+                return super()._perform_early_stopping_test(epoch)
+            finally:
+                self.check_seconds += time.time() - start
+
+    TimedModel.__name__ = model_class.__name__
+    return TimedModel
@@ -1,21 +1,25 @@
 import json
 import numpy as np
 from ampligraph.latent_features import ComplEx
-from ampligraph.evaluation import evaluate_performance, mrr_score, hits_at_n_score, \
-    train_test_split_no_unseen
+from ampligraph.evaluation import evaluate_performance, mrr_score, hits_at_n_score
 from ampligraph.utils.model_utils import create_tensorboard_visualizations
 from ampligraph.evaluation.metrics import mr_score
-from io import StringIO
-import pandas as pd
+from triple_store import load_triples, load_entities
+from splits import cached_splits
+from filter_index import FilterIndex
+from early_stopping import early_stopping_params, timed
+from ranking import RankingEngine, metrics
+from breakdown import GroupedMetrics
 import argparse
+import time
 
 parser = argparse.ArgumentParser(description="Evaluate a given graph database")
 parser.add_argument('-relations', help="Specify the file location of the various relations "
-                                       "between nodes", required=True,
-                    metavar="RPATH")
+                                       "between nodes, a csv or a .npy triple file",
+                    required=True, metavar="RPATH")
 parser.add_argument('-word-filter', help="Specify the nodes/words that should be masked over for "
-                                         "evaluation", required=True, metavar="FPATH",
-                    dest="word_filter")
+                                         "evaluation, a csv or a .npy file", required=True,
+                    metavar="FPATH", dest="word_filter")
 parser.add_argument('-model-config', help="The file that holds the model evaluation properties. If"
                                           "not specified automatically uses evaluation_params.json in the"
                                           "root dir.", required=False, metavar="MCFG",
@@ -24,22 +28,27 @@ parser.add_argument('-v', help="Verbose output for evaluation", required=False,
                     metavar="VERBOSE", dest="verbose", default=False, type=bool)
 parser.add_argument('-tensorboard-dir', help="Dir of the embedding for tensorboard",
                     required=False, metavar="TENSDIR", dest='tensorboard_dir')
+parser.add_argument('-split-seed', help="Seed of the train/valid/test split", default=0,
+                    type=int, dest="split_seed")
+parser.add_argument('-split-cache', help="Directory the splits are cached in", default="splits",
+                    dest="split_cache")
+parser.add_argument('-ranking', help="Rank the test triples with ampligraph, the vectorised "
+                                      "engine or both to compare them", required=False,
+                    choices=["ampligraph", "engine", "both"], default="ampligraph")
+parser.add_argument('-test-size', help="Amount of test triples that are ranked, 0 ranks the "
+                                       "whole test split", required=False, default=2000,
+                    type=int, dest="test_size")
+parser.add_argument('-breakdown', help="Write the metrics per relation, relation family and "
+                                       "head/tail side to this json file", required=False,
+                    metavar="BPATH")
 args = parser.parse_args()
 
-with open(args.relations) as file:
-    data = file.read()
-    pdata = pd.read_csv(StringIO(data), delimiter=',').values
-    X_train_valid, X_train = train_test_split_no_unseen(pdata, test_size=0.7)
-    X_test, X_valid = train_test_split_no_unseen(X_train_valid, test_size=0.5,
-                                                 allow_duplication=True)
-    X = {'train': X_train,
-         'valid': X_valid,
-         'test': X_test}
-with open(args.word_filter) as file:
-    data = file.read()
-    pdata = pd.read_csv(StringIO(data), delimiter=',').values.squeeze()
+triples, relation_names = load_triples(args.relations)
+X = cached_splits(triples, args.split_seed, args.split_cache)
+pdata = load_entities(args.word_filter)
 
 filter_triples = np.concatenate((X['train'], X['valid'], X['test']))
+index = FilterIndex(filter_triples)
 
 cfg_file = "evaluation_params.json"
 if args.model_config is not None:
@@ -47,20 +56,15 @@ if args.model_config is not None:
 with open(cfg_file, "r") as file:
     config = json.load(file)
 
-model = ComplEx(**config["cfg"])
+model = timed(ComplEx)(**config["cfg"])
 
+start = time.time()
 if config["early_stopping"] is False:
     model.fit(np.concatenate((X['train'], X['valid'])))
 else:
-    model.fit(np.concatenate((X['train'], X['valid'])), True, {
-        'x_valid': X['valid'][::2],
-        'criteria': 'mrr',
-        'x_filter': filter_triples,
-        'corruption_entities': pdata,
-        'stop_interval': 4,
-        'burn_in': 0,
-        'check_interval': 50
-    })
+    model.fit(np.concatenate((X['train'], X['valid'])), True,
+              early_stopping_params(config, X, pdata, index))
+fit_seconds = time.time() - start
 
 if not hasattr(model, 'early_stopping_epoch') or model.early_stopping_epoch is None:
     early_stopping_epoch = np.nan
@@ -70,23 +74,51 @@ else:
 if args.tensorboard_dir is not None:
     create_tensorboard_visualizations(model, args.tensorboard_dir)
 
-ranks = evaluate_performance(X['test'][:2000], model=model,
-                             filter_triples=filter_triples,
-                             filter_unseen=True,
-                             entities_subset=pdata,
-                             use_default_protocol=True,
-                             verbose=args.verbose)
-mr = mr_score(ranks)
-mrr = mrr_score(ranks)
-hits_1 = hits_at_n_score(ranks, n=1)
-hits_3 = hits_at_n_score(ranks, n=3)
-hits_10 = hits_at_n_score(ranks, n=10)
+X_test = X['test'] if args.test_size == 0 else X['test'][:args.test_size]
+breakdown = GroupedMetrics(relation_names) if args.breakdown is not None else None
+results = {}
+if args.ranking in ["ampligraph", "both"]:
+    start = time.time()
+    ranks = evaluate_performance(X_test, model=model,
+                                 filter_triples=filter_triples,
+                                 filter_unseen=True,
+                                 entities_subset=pdata,
+                                 use_default_protocol=True,
+                                 verbose=args.verbose)
+    results["ampligraph"] = {"mr": mr_score(ranks), "mrr": mrr_score(ranks),
+                             "H@1": hits_at_n_score(ranks, n=1),
+                             "H@3": hits_at_n_score(ranks, n=3),
+                             "H@10": hits_at_n_score(ranks, n=10),
+                             "ranking_seconds": time.time() - start}
+    if breakdown is not None and args.ranking == "ampligraph":
+        # The ranks of the triples that filter_unseen kept, in the order of X_test
+        seen = np.isin(X_test[:, 0], list(model.ent_to_idx)) & \
+            np.isin(X_test[:, 1], list(model.rel_to_idx)) & \
+            np.isin(X_test[:, 2], list(model.ent_to_idx))
+        breakdown.update(X_test[seen], ranks)
+if args.ranking in ["engine", "both"]:
+    start = time.time()
+    engine_ranks = []
+    for block, block_ranks in RankingEngine.from_model(model).iter_ranks(X_test, pdata,
+                                                                          index=index):
+        engine_ranks.append(block_ranks)
+        if breakdown is not None:
+            breakdown.update(block, block_ranks)
+    engine_ranks = np.concatenate(engine_ranks) if len(engine_ranks) > 0 \
+        else np.empty((0, 2), dtype=np.int64)
+    results["engine"] = dict(metrics(engine_ranks), ranking_seconds=time.time() - start)
+if args.ranking == "both":
+    print({"max_rank_difference": int(np.abs(np.asarray(ranks).reshape(engine_ranks.shape) -
+                                             engine_ranks).max())})
+    print({"engine": results["engine"]})
 
-print({
-    "mr": mr,
-    "mrr": mrr,
-    "H@1": hits_1,
-    "H@3": hits_3,
-    "H@10": hits_10,
-    "early_stopping_epoch": early_stopping_epoch
-})
+print(dict(results["ampligraph" if "ampligraph" in results else "engine"], **{
+    "early_stopping_epoch": early_stopping_epoch,
+    "training_seconds": fit_seconds - model.check_seconds,
+    "check_seconds": model.check_seconds
+}))
+
+if breakdown is not None:
+    breakdown.save(args.breakdown, ranking="engine" if "engine" in results else "ampligraph",
+                   relations=args.relations, split_seed=args.split_seed,
+                   test_size=args.test_size)
@@ -0,0 +1,187 @@
+import argparse
+import csv
+import fnmatch
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from neomodel import db, config
+
+import GraphModel  # Applies NEO4J_BOLT_URL to the neomodel config
+from triple_store import relations_path
+
+"""
+Streams the (id, type, id) triples between root words and the root word ids used as entity
+filters straight from the database into csv, gzipped csv or .npy files. The results are read
+page by page through the driver, so the memory use doesn't grow with the size of the graph and,
+unlike apoc.export.csv.query, nothing is written on the database host
+"""
+
+TRIPLE_HEADER = ["word1", "Relation", "word2"]
+
+
+def open_text(path: str):
+    """
+    :param path: A .csv or .csv.gz file
+    :return: The file opened for writing text, gzip compressed if the name ends with .gz
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, 'wt', newline='')
+    return open(path, 'w', newline='')
+
+
+def select_relation_types(include: list, exclude: list, run_query=None) -> list:
+    """
+    :param include: Patterns like BERT_* of the relationship types that are exported
+    :param exclude: Patterns of the relationship types that are skipped
+    :param run_query: A function taking a query and returning (results, meta), defaults to
+    db.cypher_query
+    :return: The sorted relationship types of the db matching the filters
+    """
+    if run_query is None:
+        run_query = db.cypher_query
+    results, _ = run_query("CALL db.relationshipTypes() YIELD relationshipType "
+                           "RETURN relationshipType")
+    return sorted(relation_type for relation_type, in results
+                  if any(fnmatch.fnmatchcase(relation_type, pattern) for pattern in include)
+                  and not any(fnmatch.fnmatchcase(relation_type, pattern) for pattern in exclude))
+
+
+class TripleExporter:
+
+    def __init__(self, page_size: int = 100000, label: str = "RootWord"):
+        """
+        :param page_size: The amount of records fetched from the server and written at once
+        :param label: The label of the start and end nodes of the exported relationships
+        """
+        self.page_size = page_size
+        self.label = label
+
+    def __enter__(self):
+        # One driver is used for the whole export and closed at the end
+        db.set_connection(config.DATABASE_URL)
+        return self
+
+    def __exit__(self, *exc_info):
+        db.driver.close()
+
+    def pages(self, query: str, params: dict = None):
+        """
+        Runs a query in its own session of the exporter's driver and reads the results page by
+        page
+        :param query: The cypher query
+        :param params: The parameters of the query
+        :return: Generator of lists of up to page_size result rows
+        """
+        with db.driver.session(fetch_size=self.page_size) as session:
+            page = []
+            for record in session.run(query, params or {}):
+                page.append(record.values())
+                if len(page) == self.page_size:
+                    yield page
+                    page = []
+            if len(page) > 0:
+                yield page
+
+    def triple_pages(self, relation_types: list):
+        return self.pages(f"""MATCH (o:{self.label})-[r]->(k:{self.label})
+            WHERE type(r) IN $types
+            RETURN id(o), type(r), id(k)""", {"types": relation_types})
+
+    def export_triples(self, path: str, relation_types: list) -> int:
+        """
+        Writes the triples of the given relationship types. A .npy file holds one int32 row of
+        (start id, relation id, end id) per triple, the relation names of the relation ids are
+        written to a .relations.json file next to it. Any other file is written as csv
+        :param path: The output file, .csv, .csv.gz or .npy
+        :param relation_types: The relationship types that are exported
+        :return: The amount of triples written
+        """
+        if path.endswith(".npy"):
+            return self.export_npy(path, relation_types)
+        written = 0
+        with open_text(path) as file:
+            writer = csv.writer(file)
+            writer.writerow(TRIPLE_HEADER)
+            for page in self.triple_pages(relation_types):
+                writer.writerows(page)
+                written += len(page)
+                print(f"Exported {written} triples")
+        return written
+
+    def export_npy(self, path: str, relation_types: list) -> int:
+        relation_ids = {relation_type: i for i, relation_type in enumerate(relation_types)}
+        written = 0
+        # The amount of rows is only known at the end, so the rows are collected in a raw file
+        # first and copied behind the .npy header afterwards
+        with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path))) as raw:
+            for page in self.triple_pages(relation_types):
+                rows = np.array([(start, relation_ids[relation_type], end)
+                                 for start, relation_type, end in page], dtype=np.int32)
+                rows.tofile(raw)
+                written += len(page)
+                print(f"Exported {written} triples")
+            raw.seek(0)
+            with open(path, 'wb') as file:
+                np.lib.format.write_array_header_1_0(
+                    file, {"descr": np.lib.format.dtype_to_descr(np.dtype(np.int32)),
+                           "fortran_order": False, "shape": (written, 3)})
+                shutil.copyfileobj(raw, file)
+        with open(relations_path(path), 'w') as file:
+            json.dump(relation_types, file)
+        return written
+
+    def export_entities(self, path: str, label: str, header: str) -> int:
+        """
+        Writes the ids of all nodes with a label, one per line
+        :param path: The output file, .csv or .csv.gz
+        :param label: The label of the nodes
+        :param header: The column name
+        :return: The amount of ids written
+        """
+        written = 0
+        with open_text(path) as file:
+            writer = csv.writer(file, quoting=csv.QUOTE_ALL)
+            writer.writerow([header])
+            for page in self.pages(f"MATCH (n:{label}) RETURN id(n)"):
+                writer.writerows(page)
+                written += len(page)
+        return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the relationships between root words as "
+                                                 "triples for the evaluation")
+    parser.add_argument('--output', help="The triple file, .csv, .csv.gz or .npy", metavar="PATH")
+    parser.add_argument('--relations', help="Comma separated patterns of the exported "
+                                            "relationship types, e.g. BERT_*", default="*")
+    parser.add_argument('--exclude', help="Comma separated patterns of the relationship types "
+                                          "that are skipped", default="")
+    parser.add_argument('--root-words', help="Also write the ids of all root words to this file",
+                        metavar="PATH", dest="root_words")
+    parser.add_argument('--root-objects', help="Also write the ids of the root word objects to "
+                                               "this file", metavar="PATH", dest="root_objects")
+    parser.add_argument('--page-size', help="Amount of records fetched and written at once",
+                        default=100000, type=int, dest="page_size")
+    args = parser.parse_args()
+
+    with TripleExporter(args.page_size) as exporter:
+        if args.output is not None:
+            relation_types = select_relation_types(args.relations.split(","),
+                                                   [p for p in args.exclude.split(",") if p != ""])
+            print(f"Exporting {', '.join(relation_types)}")
+            written = exporter.export_triples(args.output, relation_types)
+            print(f"Wrote {written} triples to {args.output}")
+        if args.root_words is not None:
+            written = exporter.export_entities(args.root_words, "RootWord", "id(o)")
+            print(f"Wrote {written} root words to {args.root_words}")
+        if args.root_objects is not None:
+            written = exporter.export_entities(args.root_objects, "RootWordObject", "id(n)")
+            print(f"Wrote {written} root word objects to {args.root_objects}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@
  Author: Alexander Henlein
 """
 
+from functools import lru_cache
 from typing import TYPE_CHECKING, Optional, Union
 
 import numpy as np
@@ -14,6 +15,16 @@ from transformers.utils import logging
 from transformers.pipelines.base import PIPELINE_INIT_ARGS, ArgumentHandler, Pipeline, PipelineException
 
 
+@lru_cache(maxsize=None)
+def vocabulary_strings(tokenizer: PreTrainedTokenizer) -> np.ndarray:
+    """
+    :param tokenizer: The tokenizer of the model
+    :return: The decoded token string of every vocabulary id, decoded once per tokenizer and shared by every
+    pipeline and caller using it
+    """
+    return np.array([tokenizer.decode(id_) for id_ in range(len(tokenizer))], dtype=object)
+
+
 if TYPE_CHECKING:
     from transformers.modeling_tf_utils import TFPreTrainedModel
     from transformers.modeling_utils import PreTrainedModel
@@ -61,6 +72,7 @@ class FillMoreMaskPipeline(Pipeline):
         device: int = -1,
         top_k=5,
         task: str = "",
+        check_model: bool = True,
     ):
 
         super().__init__(
@@ -73,8 +85,13 @@ class FillMoreMaskPipeline(Pipeline):
             binary_output=True,
             task=task,
         )
-        self.check_model_type(TF_MODEL_WITH_LM_HEAD_MAPPING if self.framework == "tf" else MODEL_FOR_MASKED_LM_MAPPING)
+        # Exported models, e.g. run with ONNX Runtime, aren't part of the model mappings
+        if check_model:
+            self.check_model_type(TF_MODEL_WITH_LM_HEAD_MAPPING if self.framework == "tf" else MODEL_FOR_MASKED_LM_MAPPING)
         self.top_k = top_k
+        # Restricts every prediction to these vocabulary ids when no targets are passed
+        self.target_ids = None
+        self._target_ids_cache = {}
 
     def ensure_exactly_min_one_mask_token(self, masked_index: np.ndarray):
         numel = np.prod(masked_index.shape)
@@ -85,7 +102,64 @@ class FillMoreMaskPipeline(Pipeline):
                 f"No mask_token ({self.tokenizer.mask_token}) found on the input",
             )
 
-    def __call__(self, *args, targets=None, top_k: Optional[int] = None, **kwargs):
+    def get_target_ids(self, targets) -> np.ndarray:
+        """
+        Converts the targets to vocabulary ids. The result is cached per targets, so the vocab
+        isn't rebuilt on every call
+        """
+        if isinstance(targets, str):
+            targets = [targets]
+        key = tuple(targets)
+        if key in self._target_ids_cache:
+            return self._target_ids_cache[key]
+
+        try:
+            vocab = self.tokenizer.get_vocab()
+        except Exception:
+            vocab = {}
+        target_ids = []
+        for target in targets:
+            id_ = vocab.get(target, None)
+            if id_ is None:
+                input_ids = self.tokenizer(
+                    target,
+                    add_special_tokens=False,
+                    return_attention_mask=False,
+                    return_token_type_ids=False,
+                    max_length=1,
+                    truncation=True,
+                )["input_ids"]
+                if len(input_ids) == 0:
+                    logger.warning(
+                        f"The specified target token `{target}` does not exist in the model vocabulary. "
+                        f"We cannot replace it with anything meaningful, ignoring it"
+                    )
+                    continue
+                id_ = input_ids[0]
+                # XXX: If users encounter this pass
+                # it becomes pretty slow, so let's make sure
+                # The warning enables them to fix the input to
+                # get faster performance.
+                logger.warning(
+                    f"The specified target token `{target}` does not exist in the model vocabulary. "
+                    f"Replacing with `{self.tokenizer.convert_ids_to_tokens(id_)}`."
+                )
+            target_ids.append(id_)
+        target_ids = list(set(target_ids))
+        if len(target_ids) == 0:
+            raise ValueError("At least one target must be provided when passed.")
+        target_ids = np.array(target_ids)
+        self._target_ids_cache[key] = target_ids
+        return target_ids
+
+    def get_id_to_str(self) -> np.ndarray:
+        """
+        :return: The decoded token string of every vocabulary id, built once on first use
+        """
+        return vocabulary_strings(self.tokenizer)
+
+    def __call__(self, *args, targets=None, top_k: Optional[int] = None,
+                 return_tokenization: bool = False, **kwargs):
         """
         Fill the masked token in the text(s) given as inputs.
 
@@ -98,14 +172,20 @@ class FillMoreMaskPipeline(Pipeline):
                 resulting token will be used (with a warning, and that might be slower).
             top_k (:obj:`int`, `optional`):
                 When passed, overrides the number of predictions to return.
+            return_tokenization (:obj:`bool`, `optional`):
+                When passed, every result also holds the tokenized input. This decodes and tokenizes every input
+                again, which is slow.
 
         Return:
-            A list or a list of list of :obj:`dict`: Each result comes as list of dictionaries with the following keys:
+            A dict or a list of dicts: Each result holds **mask_results**, a list with one list of predictions per mask.
+            Each prediction is a dictionary with the following keys:
 
-            - **sequence** (:obj:`str`) -- The corresponding input with the mask token prediction.
             - **score** (:obj:`float`) -- The corresponding probability.
-            - **token** (:obj:`int`) -- The predicted token id (to replace the masked one).
-            - **token** (:obj:`str`) -- The predicted token (to replace the masked one).
+            - **token** (:obj:`int`) -- The predicted token id.
+            - **token_str** (:obj:`str`) -- The predicted token (to replace the masked one).
+
+            With return_tokenization the result also holds **tokenized**, **bert_tokenized** and
+            **bert_tokenized_mapping**.
         """
         inputs = self._parse_and_tokenize(*args, **kwargs)
         outputs = self._forward(inputs, return_tensors=True)
@@ -117,50 +197,37 @@ class FillMoreMaskPipeline(Pipeline):
         results = []
         batch_size = outputs.shape[0] if self.framework == "tf" else outputs.size(0)
 
+        target_ids = None
         if targets is not None:
-            if isinstance(targets, str):
-                targets = [targets]
-
-            try:
-                vocab = self.tokenizer.get_vocab()
-            except Exception:
-                vocab = {}
-            target_ids = []
-            for target in targets:
-                id_ = vocab.get(target, None)
-                if id_ is None:
-                    input_ids = self.tokenizer(
-                        target,
-                        add_special_tokens=False,
-                        return_attention_mask=False,
-                        return_token_type_ids=False,
-                        max_length=1,
-                        truncation=True,
-                    )["input_ids"]
-                    if len(input_ids) == 0:
-                        logger.warning(
-                            f"The specified target token `{target}` does not exist in the model vocabulary. "
-                            f"We cannot replace it with anything meaningful, ignoring it"
-                        )
-                        continue
-                    id_ = input_ids[0]
-                    # XXX: If users encounter this pass
-                    # it becomes pretty slow, so let's make sure
-                    # The warning enables them to fix the input to
-                    # get faster performance.
-                    logger.warning(
-                        f"The specified target token `{target}` does not exist in the model vocabulary. "
-                        f"Replacing with `{self.tokenizer.convert_ids_to_tokens(id_)}`."
-                    )
-                target_ids.append(id_)
-            target_ids = list(set(target_ids))
-            if len(target_ids) == 0:
-                raise ValueError("At least one target must be provided when passed.")
-            target_ids = np.array(target_ids)
+            target_ids = self.get_target_ids(targets)
+        elif self.target_ids is not None:
+            target_ids = self.target_ids
+        if target_ids is not None:
             # Cap top_k if there are targets
             if top_k > target_ids.shape[0]:
                 top_k = target_ids.shape[0]
 
+        id_to_str = self.get_id_to_str()
+        if self.framework == "pt":
+            # Softmax, top k and token lookup of all masks of the whole batch at once
+            mask_positions = torch.nonzero(inputs["input_ids"] == self.tokenizer.mask_token_id,
+                                           as_tuple=False)
+            mask_counts = torch.bincount(mask_positions[:, 0], minlength=batch_size).tolist()
+            if min(mask_counts) < 1:
+                # Every sample needs at least one ${mask_token}
+                self.ensure_exactly_min_one_mask_token(np.empty(0))
+            batch_probs = outputs[mask_positions[:, 0], mask_positions[:, 1], :].softmax(dim=-1)
+            if target_ids is not None:
+                batch_probs = batch_probs[:, torch.as_tensor(target_ids)]
+            batch_values, batch_predictions = batch_probs.topk(top_k)
+            batch_predictions = batch_predictions.numpy()
+            if target_ids is not None:
+                batch_predictions = target_ids[batch_predictions]
+            batch_token_strs = id_to_str[batch_predictions].tolist()
+            batch_ids = batch_predictions.tolist()
+            batch_values = batch_values.tolist()
+
+        row = 0
         for i in range(batch_size):
             input_ids = inputs["input_ids"][i]
 
@@ -173,60 +240,36 @@ class FillMoreMaskPipeline(Pipeline):
 
                 logits = outputs[i, masked_index.item(), :]
                 probs = tf.nn.softmax(logits)
-                if targets is not None:
+                if target_ids is not None:
                     probs = tf.gather_nd(probs, tf.reshape(target_ids, (-1, 1)))
 
                 topk = tf.math.top_k(probs, k=top_k)
                 values, predictions = topk.values.numpy(), topk.indices.numpy()
+                if target_ids is not None:
+                    predictions = target_ids[predictions]
+                values, token_strs = [values.tolist()], [id_to_str[predictions].tolist()]
+                ids = [predictions.tolist()]
             else:
-                masked_index = torch.nonzero(input_ids == self.tokenizer.mask_token_id,
-                                             as_tuple=False)
-                # Fill mask pipeline supports only one ${mask_token} per sample
-                self.ensure_exactly_min_one_mask_token(masked_index.numpy())
-
-                masked_index = masked_index.flatten()
-                logits = outputs[i, masked_index, :]
-
-                probs = logits.softmax(dim=1)
-                if targets is not None:
-                    probs = probs[..., target_ids]
-
-                values, predictions = probs.topk(top_k)
-
-            mask_results = []
-
-            sentence = self.tokenizer.decode(input_ids[1:-1], skip_special_tokens=False)
-            encoded = self.tokenizer(sentence)
-            for value, prediction in zip(values.tolist(), predictions.tolist()):
-                mask_result = []
-                tokens = input_ids.numpy()
-                for v, p in zip(value, prediction):
-                    if targets is not None:
-                        p = target_ids[p].tolist()
-                    tokens[masked_index] = p
-                    # Filter padding out:
-                    tokens = tokens[np.where(tokens != self.tokenizer.pad_token_id)]
-                    mask_result.append(
-                        {
-                            #"sequence": self.tokenizer.decode(tokens, skip_special_tokens=True),
-                            "score": v,
-                            #"token": p,
-                            "token_str": self.tokenizer.decode(p),
-                        }
-                    )
-                mask_results.append(mask_result)
-
-
-            # Ziehmlicher fusch, aber funktioniert -.-
-
-            results.append(
-                {
+                values = batch_values[row:row + mask_counts[i]]
+                token_strs = batch_token_strs[row:row + mask_counts[i]]
+                ids = batch_ids[row:row + mask_counts[i]]
+                row += mask_counts[i]
+
+            mask_results = [[{"score": v, "token": t_id, "token_str": t}
+                             for v, t_id, t in zip(value, token_id, token_str)]
+                            for value, token_id, token_str in zip(values, ids, token_strs)]
+            result = {'mask_results': mask_results}
+
+            if return_tokenization:
+                # Ziehmlicher fusch, aber funktioniert -.-
+                sentence = self.tokenizer.decode(input_ids[1:-1], skip_special_tokens=False)
+                encoded = self.tokenizer(sentence)
+                result.update({
                     'tokenized': sentence.split(),
                     'bert_tokenized': encoded.tokens(),
                     'bert_tokenized_mapping': encoded.words(),
-                    'mask_results': mask_results
-                }
-            )
+                })
+            results.append(result)
 
         if len(results) == 1:
             return results[0]
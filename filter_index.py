@@ -0,0 +1,72 @@
+import numpy as np
+
+"""
+Index of the known triples used to filter the ranking of corrupted triples. The objects of every
+(subject, relation) pair and the subjects of every (relation, object) pair are kept in sorted
+arrays, so the known corruptions of many triples are looked up with a few vectorised searches
+"""
+
+
+class FilterIndex:
+
+    def __init__(self, triples: np.ndarray):
+        """
+        :param triples: All known (subject, relation, object) triples as integers
+        """
+        triples = np.asarray(triples, dtype=np.int64)
+        self.relations = int(triples[:, 1].max()) + 1 if len(triples) > 0 else 1
+        self.sp_keys, self.sp_objects = self.sort(self.key(triples[:, 0], triples[:, 1]),
+                                                  triples[:, 2])
+        self.po_keys, self.po_subjects = self.sort(self.key(triples[:, 2], triples[:, 1]),
+                                                   triples[:, 0])
+
+    def key(self, entities: np.ndarray, relations: np.ndarray) -> np.ndarray:
+        return np.asarray(entities, dtype=np.int64) * self.relations + \
+            np.asarray(relations, dtype=np.int64)
+
+    @staticmethod
+    def sort(keys: np.ndarray, values: np.ndarray):
+        order = np.lexsort((values, keys))
+        return keys[order], values[order]
+
+    @staticmethod
+    def lookup(sorted_keys: np.ndarray, sorted_values: np.ndarray, keys: np.ndarray):
+        """
+        :return: The (query row, value) pairs of all the values stored under the keys
+        """
+        starts = np.searchsorted(sorted_keys, keys, side='left')
+        ends = np.searchsorted(sorted_keys, keys, side='right')
+        counts = ends - starts
+        rows = np.repeat(np.arange(len(keys)), counts)
+        # Position of every value: the start of its row plus its offset within the row
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return rows, sorted_values[np.repeat(starts, counts) + offsets]
+
+    def known_objects(self, subjects: np.ndarray, relations: np.ndarray):
+        """
+        :return: The (query row, object) pairs of all known triples with the subject and relation
+        of a query row
+        """
+        return self.lookup(self.sp_keys, self.sp_objects, self.key(subjects, relations))
+
+    def known_subjects(self, relations: np.ndarray, objects: np.ndarray):
+        """
+        :return: The (query row, subject) pairs of all known triples with the relation and object
+        of a query row
+        """
+        return self.lookup(self.po_keys, self.po_subjects, self.key(objects, relations))
+
+    def filter_for(self, triples: np.ndarray) -> np.ndarray:
+        """
+        Collects the known triples that are corruptions of the given triples. Filtering the
+        ranking of these triples with this subset gives the same ranks as with all known triples
+        :param triples: The triples that are going to be ranked
+        :return: The known triples sharing the subject and relation or the relation and object
+        with one of them
+        """
+        triples = np.asarray(triples, dtype=np.int64)
+        rows, objects = self.known_objects(triples[:, 0], triples[:, 1])
+        tails = np.stack((triples[rows, 0], triples[rows, 1], objects), axis=1)
+        rows, subjects = self.known_subjects(triples[:, 1], triples[:, 2])
+        heads = np.stack((subjects, triples[rows, 1], triples[rows, 2]), axis=1)
+        return np.unique(np.concatenate((tails, heads)), axis=0).astype(np.int32)
@@ -0,0 +1,289 @@
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from thread_limits import limit_threads
+
+"""
+Hyperparameter search for ComplEx that trains the configurations in a pool of processes. Every
+finished trial is appended to a results log right away, so an interrupted search continues with
+the trials that are missing. With successive halving all configurations are trained for a few
+epochs first and only the best fraction is trained longer
+"""
+
+# The data of the worker process, loaded by the first trial it runs
+worker_data = None
+
+
+def flatten_grid(grid: dict, prefix: tuple = ()) -> dict:
+    """
+    :param grid: A (nested) parameter grid like best_model_params.param_grid
+    :return: A dict mapping the key path of every leaf to its value
+    """
+    leaves = {}
+    for key, value in grid.items():
+        if isinstance(value, dict) and len(value) > 0:
+            leaves.update(flatten_grid(value, prefix + (key,)))
+        else:
+            leaves[prefix + (key,)] = value
+    return leaves
+
+
+def unflatten(leaves: dict) -> dict:
+    params = {}
+    for path, value in leaves.items():
+        node = params
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = value
+    return params
+
+
+def sample_configurations(grid: dict, max_combinations: int, seed: int = 0) -> list:
+    """
+    Draws distinct configurations from the grid. Lists are choices and functions are called for
+    a value, anything else is used as it is. Without functions and with enough combinations
+    allowed the whole grid is enumerated
+    :param grid: The parameter grid
+    :param max_combinations: The maximal amount of configurations
+    :param seed: The seed of the random draws
+    :return: A list of parameter dicts
+    """
+    leaves = flatten_grid(grid)
+    choices = {path: value if isinstance(value, list) else [value]
+               for path, value in leaves.items() if not callable(value)}
+    samplers = {path: value for path, value in leaves.items() if callable(value)}
+    total = math.prod(len(values) for values in choices.values())
+    if len(samplers) == 0 and total <= max_combinations:
+        return [unflatten(dict(zip(choices.keys(), values)))
+                for values in itertools.product(*choices.values())]
+
+    python_state, numpy_state = random.getstate(), np.random.get_state()
+    random.seed(seed)
+    np.random.seed(seed)
+    configurations = {}
+    attempts = 0
+    while len(configurations) < max_combinations and attempts < max_combinations * 100:
+        attempts += 1
+        leaf_values = {path: random.choice(values) for path, values in choices.items()}
+        leaf_values.update({path: sampler() for path, sampler in samplers.items()})
+        params = unflatten(leaf_values)
+        configurations.setdefault(trial_id(params), params)
+    random.setstate(python_state)
+    np.random.set_state(numpy_state)
+    return list(configurations.values())
+
+
+def trial_id(params: dict) -> str:
+    """
+    :param params: The parameters of a configuration
+    :return: A hash identifying the configuration
+    """
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def halving_rungs(max_epochs: int, min_epochs: int = None, eta: int = 3) -> list:
+    """
+    :param max_epochs: The epochs of a fully trained configuration
+    :param min_epochs: The epochs of the first rung, None disables successive halving
+    :param eta: The factor between the epochs of two rungs
+    :return: The epochs of every rung
+    """
+    if min_epochs is None or min_epochs >= max_epochs:
+        return [max_epochs]
+    rungs = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= eta
+    return rungs + [max_epochs]
+
+
+def file_digest(path: str) -> str:
+    """
+    :return: The sha1 of the contents of a file
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def data_fingerprint(data: dict, triples: np.ndarray = None) -> str:
+    """
+    :param data: The paths and settings of the evaluation data
+    :param triples: The loaded triples of data["relations"], loaded here if they're missing
+    :return: A hash of everything that changes the results: the settings in data but verbose, the
+    contents of the triples and of the word filter file, so files regenerated at the same path
+    don't match
+    """
+    from splits import split_key
+    from triple_store import load_triples
+    if triples is None:
+        triples, _ = load_triples(data["relations"])
+    settings = {key: value for key, value in data.items() if key != "verbose"}
+    settings["triples"] = split_key(triples, data["split_seed"], 0.7, 0.5)
+    settings["word_filter_contents"] = file_digest(data["word_filter"])
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def read_log(path: str, fingerprint: str = None) -> dict:
+    """
+    :param path: The results log, one json object per line
+    :param fingerprint: Only the results with this data fingerprint are read, None reads all
+    :return: A dict mapping (trial id, epochs, split) to the logged result
+    """
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path) as file:
+        for line in file:
+            if line.strip() == "":
+                continue
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut off by an interruption
+                continue
+            if fingerprint is not None and result.get("data") != fingerprint:
+                # A result of another dataset or other evaluation settings
+                continue
+            results[(result["trial"], result["epochs"], result["split"])] = result
+    return results
+
+
+def load_data(data: dict) -> dict:
+    """
+    :param data: The paths and settings of the evaluation data
+    :return: The splits, the filter triples and the word filter
+    """
+    from filter_index import FilterIndex
+    from splits import cached_splits
+    from triple_store import load_triples, load_entities
+    triples, _ = load_triples(data["relations"])
+    X = cached_splits(triples, data["split_seed"], data["split_cache"])
+    known = np.concatenate((X["train"], X["valid"], X["test"]))
+    return {"X": X, "filter": known, "index": FilterIndex(known),
+            "entities": load_entities(data["word_filter"])}
+
+
+def run_trial(task: tuple) -> dict:
+    """
+    Trains one configuration and evaluates it on the valid or the test split
+    :param task: The (trial id, params, epochs, split, data) tuple
+    :return: The result that's written to the log
+    """
+    from ampligraph.latent_features import ComplEx
+    from ampligraph.evaluation import evaluate_performance, mrr_score, hits_at_n_score
+    from ampligraph.evaluation.metrics import mr_score
+    from early_stopping import early_stopping_params, timed
+    global worker_data
+    trial, params, epochs, split, data = task
+    if worker_data is None:
+        worker_data = load_data(data)
+    X = worker_data["X"]
+    start = time.time()
+    model = timed(ComplEx)(**dict(params, epochs=epochs))
+    if split == "test":
+        train = np.concatenate((X["train"], X["valid"]))
+        evaluation = X["test"][:data["test_limit"]]
+    else:
+        # Every evaluation_step th valid triple is evaluated, independent of the early stopping
+        # sample that's chosen by the early_stopping_params
+        train, evaluation = X["train"], X["valid"][::data["evaluation_step"]]
+    if data["early_stopping"]:
+        model.fit(train, True, early_stopping_params(data, X, worker_data["entities"],
+                                                     worker_data["index"]))
+    else:
+        model.fit(train)
+    fit_seconds = time.time() - start
+    ranks = evaluate_performance(evaluation, model=model, filter_triples=worker_data["filter"],
+                                 filter_unseen=True, entities_subset=worker_data["entities"],
+                                 use_default_protocol=True, verbose=data["verbose"])
+    return {"trial": trial, "epochs": epochs, "split": split, "params": params,
+            "mr": float(mr_score(ranks)), "mrr": float(mrr_score(ranks)),
+            "H@1": float(hits_at_n_score(ranks, n=1)), "H@3": float(hits_at_n_score(ranks, n=3)),
+            "H@10": float(hits_at_n_score(ranks, n=10)), "seconds": time.time() - start,
+            "training_seconds": fit_seconds - model.check_seconds,
+            "check_seconds": model.check_seconds}
+
+
+class SearchRunner:
+
+    def __init__(self, data: dict, log_path: str = "search_results.jsonl", workers: int = 1,
+                 threads: int = 1, min_epochs: int = None, eta: int = 3,
+                 triples: np.ndarray = None):
+        """
+        :param data: The paths and settings of the evaluation data, see load_data
+        :param log_path: The results log, trials completed on the same data are not run again
+        :param workers: The amount of training processes
+        :param threads: The amount of threads per process
+        :param min_epochs: The epochs of the first successive halving rung, None trains every
+        configuration fully
+        :param eta: Only the best 1/eta of the configurations advance to the next rung
+        :param triples: The already loaded triples of data["relations"], used for the fingerprint
+        """
+        self.data = data
+        self.log_path = log_path
+        self.workers = workers
+        self.threads = threads
+        self.min_epochs = min_epochs
+        self.eta = eta
+        self.fingerprint = data_fingerprint(data, triples)
+        self.results = read_log(log_path, self.fingerprint)
+
+    def run_tasks(self, tasks: list) -> list:
+        """
+        Runs the tasks that aren't in the log yet and appends their results as they finish
+        :param tasks: (trial id, params, epochs, split) tuples
+        :return: The results of all the tasks
+        """
+        missing = [task + (self.data,) for task in tasks
+                   if (task[0], task[2], task[3]) not in self.results]
+        print(f"Running {len(missing)} trials, {len(tasks) - len(missing)} are already done")
+        if len(missing) > 0:
+            with Pool(self.workers, initializer=limit_threads, initargs=(self.threads,)) as pool, \
+                    open(self.log_path, 'a') as log:
+                for result in pool.imap_unordered(run_trial, missing):
+                    result["data"] = self.fingerprint
+                    log.write(json.dumps(result) + "\n")
+                    log.flush()
+                    self.results[(result["trial"], result["epochs"], result["split"])] = result
+                    print(f"Trial {result['trial']} ({result['epochs']} epochs): "
+                          f"mrr {result['mrr']:.4f}, H@10 {result['H@10']:.4f}")
+        return [self.results[(task[0], task[2], task[3])] for task in tasks]
+
+    def search(self, configurations: list) -> dict:
+        """
+        Trains the configurations with successive halving and evaluates the best one on the test
+        split
+        :param configurations: The parameter dicts
+        :return: The best params, their valid result and their test result
+        """
+        trials = {trial_id(params): params for params in configurations}
+        max_epochs = max(params.get("epochs", 100) for params in trials.values())
+        rungs = halving_rungs(max_epochs, self.min_epochs, self.eta)
+        survivors = list(trials)
+        results = []
+        for rung, epochs in enumerate(rungs):
+            tasks = [(trial, trials[trial],
+                      trials[trial].get("epochs", max_epochs) if rung == len(rungs) - 1
+                      else min(epochs, trials[trial].get("epochs", max_epochs)), "valid")
+                     for trial in survivors]
+            results = sorted(self.run_tasks(tasks), key=lambda result: -result["mrr"])
+            if rung < len(rungs) - 1:
+                survivors = [result["trial"] for result in
+                             results[:max(1, math.ceil(len(results) / self.eta))]]
+                print(f"Rung {rung} ({epochs} epochs): {len(survivors)} of {len(results)} "
+                      f"configurations advance")
+        best = results[0]
+        test = self.run_tasks([(best["trial"], best["params"], best["epochs"], "test")])[0]
+        return {"bestParams": best["params"], "bestValid": best, "testEval": test}
@@ -1,26 +1,74 @@
 from gensim.models.fasttext import FastTextKeyedVectors
-from neomodel import DoesNotExist, db
+from neomodel import DoesNotExist, db, config
 from nltk.corpus import wordnet as wn
-from GraphModel import ModelHelper, Lemma, Synset, RootWord, Object
-from gensim.models import FastText
+from GraphModel import ModelHelper, Lemma, Synset, RootWord
+from gensim.models import FastText, KeyedVectors
 from gensim.test.utils import datapath
+from ann_index import build_index, normalise, recall
+from batch_writer import RelationshipBatchWriter, retry_transient
+from checkpoint import Checkpoint
+from multiprocessing import Process, JoinableQueue, Event, Value
 import argparse
+import csv
+import hashlib
+import json
+import numpy as np
+import os
+import zlib
 
 
 class InsertHelper:
 
-    def __init__(self):
+    def __init__(self, wv_model: str = None):
+        """
+        :param wv_model: Optional word vector model file that's memory-mapped, or a directory
+        the trained model is cached in
+        """
         self.wv: FastTextKeyedVectors = None
+        self.wv_model = wv_model
+        # FastText is only reproducible with a fixed seed and a single worker thread
+        self.wv_params = {"vector_size": 100, "seed": 1, "workers": 1}
+
+    @staticmethod
+    def wordvector_key(corpus_file: str, params: dict) -> str:
+        """
+        :param corpus_file: The file the word vectors are trained on
+        :param params: The hyperparameters of the model
+        :return: A hash identifying the trained model
+        """
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode())
+        with open(corpus_file, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()[:16]
 
     def setup_wordvectors(self):
+        """
+        Loads the word vectors from the configured model file or cache, otherwise trains them.
+        Loaded vectors are memory-mapped read only so several processes share one copy
+        """
+        if self.wv_model is not None and os.path.isfile(self.wv_model):
+            self.wv = KeyedVectors.load(self.wv_model, mmap='r')
+            return
         corpus_file = datapath('lee_background.cor')
-        model = FastText(vector_size=100)
+        cache_path = None
+        if self.wv_model is not None:
+            os.makedirs(self.wv_model, exist_ok=True)
+            key = self.wordvector_key(corpus_file, self.wv_params)
+            cache_path = os.path.join(self.wv_model, f"fasttext-{key}.kv")
+            if os.path.exists(cache_path):
+                self.wv = KeyedVectors.load(cache_path, mmap='r')
+                return
+        model = FastText(**self.wv_params)
         model.build_vocab(corpus_file=corpus_file)
         model.train(
             corpus_file=corpus_file, epochs=model.epochs,
             total_examples=model.corpus_count, total_words=model.corpus_total_words,
         )
         self.wv = model.wv
+        if cache_path is not None:
+            # Store every array in its own file so all of them can be memory-mapped
+            self.wv.save(cache_path, sep_limit=0)
 
     def add_synsets_and_connect_relationships(self, graph_node_relation, additional_words: list):
         """
@@ -173,6 +221,33 @@ class InsertHelper:
         except DoesNotExist:
             return
 
+    @staticmethod
+    def synset_edges(synset):
+        """
+        Yields all the relationships of a wordnet synset and its lemmas that
+        set_synset_relationships and set_lemma_relationships would connect
+        :param synset: A wordnet synset
+        :return: Generator of (source_label, relation_type, target_label, source, target) tuples
+        """
+        synset_name = synset.name()
+        for lemma in synset.lemmas():
+            lemma_name = """{}.{}""".format(synset_name, lemma.name())
+            yield "Lemma", "SUBSET_OF", "RootWord", lemma_name, lemma.name()
+            yield "RootWord", "CONTAINS", "Lemma", lemma.name(), lemma_name
+            yield "Synset", "HAS_LEMMA", "Lemma", synset_name, lemma_name
+            for antonym in lemma.antonyms():
+                yield "Lemma", "HAS_ANTONYM", "Lemma", lemma_name, \
+                      """{}.{}""".format(antonym.synset().name(), antonym.name())
+            for pertainym in lemma.pertainyms():
+                yield "Lemma", "HAS_PERTAINYMS", "Lemma", lemma_name, \
+                      """{}.{}""".format(pertainym.synset().name(), pertainym.name())
+        for relation_type, related in (("HAS_HYPERNYM", synset.hypernyms()),
+                                       ("HAS_HYPONYM", synset.hyponyms()),
+                                       ("HAS_HOLONYM", synset.member_holonyms()),
+                                       ("HAS_ROOT_HYPERNYM", synset.root_hypernyms())):
+            for other in related:
+                yield "Synset", relation_type, "Synset", synset_name, other.name()
+
     @staticmethod
     def classify_objects():
         db.cypher_query("""match p = (n)-[r:HAS_HYPERNYM*1..]->(child) where child.name = 
@@ -191,85 +266,379 @@ class InsertHelper:
         db.cypher_query("""Match (:Object)-[k:HAS_LEMMA]-(l:Lemma)-[r:SUBSET_OF]->(o:RootWord)
          set o:RootWordObject""")
 
-    def add_wv_relations(self):
+    def add_wv_relations(self, topk: int = 10, min_score: float = None, block_size: int = 1024,
+                         batch_size: int = 5000, all_words: bool = False, backend: str = "exact",
+                         index_path: str = None, nprobe: int = 8, ef: int = 50,
+                         recall_sample: int = 0):
         """
-        Iterates through all the root words and adds a connection to all other root words that
-        are similair to it
+        Adds a connection from every root word object to the root words that are the most similar
+        to it. All root word objects are embedded at once and searched in the index over all root
+        words that are part of the word vector vocabulary
+        :param topk: The amount of similar root words per root word object
+        :param min_score: The minimal cosine similarity of a connection
+        :param block_size: The amount of root word objects searched at once
+        :param batch_size: The amount of relationships written per statement
+        :param all_words: Add the connections for all root words instead of only the objects
+        :param backend: The nearest neighbour index, one of exact, ivf or hnsw
+        :param index_path: Optional file an approximate index is loaded from or saved to
+        :param nprobe: The amount of clusters searched per word by the ivf index
+        :param ef: The size of the candidate list of the hnsw index
+        :param recall_sample: If positive, the recall of the index compared to the exact search
+        is printed for this amount of words
         """
         if self.wv is None:
             self.setup_wordvectors()
-        count = 0
-        object_word: Object
-        for object_word in Object.nodes:
-            lemma_word: Lemma
-            for lemma_word in object_word.lemmas:
-                for root_word in lemma_word.root_word:
-                    for (word, score) in self.wv.most_similar(root_word.name):
-                        try:
-                            model_word = RootWord.nodes.get(name=word)
-                            rel = root_word.similar.connect(model_word)
-                            rel.weight = score
-                            rel.save()
-                        except DoesNotExist:
-                            pass
-            count += 1
-            if count % 100 == 0:
-                print(count)
-
-
-def parse_nodes(wordlist: list):
+        label = "RootWord" if all_words else "RootWordObject"
+        results, _ = db.cypher_query(f"MATCH (r:{label}) RETURN r.name")
+        # A pre-trained model doesn't necessarily have a vector for every word, FastText builds
+        # one from the character ngrams
+        object_names = [name for name, in results if self.wv.has_index_for(name)]
+        if len(object_names) < len(results):
+            print(f"Skipping {len(results) - len(object_names)} words without a word vector")
+        results, _ = db.cypher_query("MATCH (r:RootWord) RETURN r.name")
+        candidate_names = [name for name, in results if name in self.wv.key_to_index]
+        if len(object_names) == 0 or len(candidate_names) == 0:
+            return
+        candidate_index = {name: i for i, name in enumerate(candidate_names)}
+        queries = normalise(np.stack([self.wv[name] for name in object_names]))
+        candidates = normalise(np.stack([self.wv[name] for name in candidate_names]))
+        # A word is never its own neighbour
+        exclude = np.array([candidate_index.get(name, -1) for name in object_names])
+        index = build_index(backend, candidates, block_size, index_path, nprobe, ef)
+        if recall_sample > 0:
+            print(f"Recall@{topk} of the {backend} index: "
+                  f"{recall(index, queries, topk, recall_sample, exclude=exclude):.4f}")
+
+        writer = RelationshipBatchWriter(batch_size)
+        for row, neighbours, scores in index.search(queries, topk, exclude):
+            for neighbour, score in zip(neighbours, scores):
+                if not np.isfinite(score) or (min_score is not None and score < min_score):
+                    break
+                writer.add("RootWord", "SIMILAR_TO", "RootWord", object_names[row],
+                           candidate_names[neighbour], float(score))
+            if (row + 1) % 10000 == 0:
+                print(row + 1)
+        writer.flush()
+        print(f"Wrote {writer.written} similarity relationships")
+
+
+class ObjectClassifier:
+    """
+    Decides whether a wordnet synset is an object the same way classify_objects does, i.e. if
+    one of its transitive hypernyms is the root synset
+    """
+
+    def __init__(self, root_name: str = "artifact.n.01"):
+        self.root_name = root_name
+        self.known = {}
+
+    def is_object(self, synset) -> bool:
+        """
+        :param synset: A wordnet synset
+        :return: True if the synset has the root synset as a transitive hypernym
+        """
+        name = synset.name()
+        if name not in self.known:
+            # Guards against hypernym cycles while the synset is being resolved
+            self.known[name] = False
+            self.known[name] = any(hypernym.name() == self.root_name or self.is_object(hypernym)
+                                   for hypernym in synset.hypernyms())
+        return self.known[name]
+
+
+def export_csv(wordlist: list, directory: str):
+    """
+    Writes the synsets/words and their relationships as csv files that can be loaded with
+    neo4j-admin import. Object and RootWordObject labels are set the same way
+    classify_objects and classify_root_word_objects would, so no database is needed
+    :param wordlist: a list of synsets
+    :param directory: the directory the csv files are written to
+    """
+    os.makedirs(directory, exist_ok=True)
+    files = []
+
+    def open_writer(file_name, header):
+        file = open(os.path.join(directory, file_name), 'w', newline='', encoding='utf-8')
+        files.append(file)
+        writer = csv.writer(file)
+        writer.writerow(header)
+        return writer
+
+    synset_header = ["name:ID(Synset)", "definition", ":LABEL"]
+    root_word_header = ["name:ID(RootWord)", ":LABEL"]
+    nodes = {
+        "Synset": open_writer("synsets.csv", synset_header),
+        "Object": open_writer("objects.csv", synset_header),
+        "Lemma": open_writer("lemmas.csv", ["name:ID(Lemma)", ":LABEL"]),
+        "RootWord": open_writer("root_words.csv", root_word_header),
+        "RootWordObject": open_writer("root_word_objects.csv", root_word_header)
+    }
+    relationships = {}
+    for relation_type, (source, target, properties) in ModelHelper.relationship_types().items():
+        header = [f":START_ID({source})", f":END_ID({target})"]
+        header += [f"{prop}:float" for prop in properties]
+        relationships[relation_type] = open_writer(f"{relation_type.lower()}.csv",
+                                                   header + [":TYPE"])
+
+    classifier = ObjectClassifier()
+    root_words = {}
+    i = 0
+    print("EXPORTING CSV")
+    for synset in wordlist:
+        is_object = classifier.is_object(synset)
+        if is_object:
+            nodes["Object"].writerow([synset.name(), synset.definition(), "Synset;Object"])
+        else:
+            nodes["Synset"].writerow([synset.name(), synset.definition(), "Synset"])
+        for lemma in synset.lemmas():
+            nodes["Lemma"].writerow(["""{}.{}""".format(synset.name(), lemma.name()), "Lemma"])
+            root_words[lemma.name()] = root_words.get(lemma.name(), False) or is_object
+        for _, relation_type, _, source, target in InsertHelper.synset_edges(synset):
+            relationships[relation_type].writerow([source, target, relation_type])
+        i += 1
+        if i % 10000 == 0:
+            print(i)
+    for name, is_object in root_words.items():
+        if is_object:
+            nodes["RootWordObject"].writerow([name, "RootWord;RootWordObject"])
+        else:
+            nodes["RootWord"].writerow([name, "RootWord"])
+    for file in files:
+        file.close()
+
+    arguments = [f"--nodes={os.path.join(directory, file_name)}" for file_name in
+                 ["synsets.csv", "objects.csv", "lemmas.csv", "root_words.csv",
+                  "root_word_objects.csv"]]
+    arguments += [f"--relationships={os.path.join(directory, f'{relation_type.lower()}.csv')}"
+                  for relation_type in relationships]
+    print("Import the files with:")
+    print("neo4j-admin import --database=neo4j " + " ".join(arguments))
+
+
+def parse_nodes(wordlist: list, start: int = 0, on_commit=None):
     """
     Takes a list of synsets/words and inserts them into the database in batches
     :param wordlist: a list of synsets
+    :param start: the offset of the first synset that should be inserted
+    :param on_commit: optional function that's called with the offset after each batch
     """
     insert_helper = InsertHelper()
     n = 400
     print("PARSING NODES")
-    for i in range(0, len(wordlist), n):
+    for i in range(start, len(wordlist), n):
         insert_helper.batch_create_synset(wordlist[i:i + n])
-        i += n
-        if i % n == 0:
-            print(i)
+        offset = min(i + n, len(wordlist))
+        if on_commit is not None:
+            on_commit(offset)
+        if offset % 4000 == 0:
+            print(offset)
+
+
+def relationship_worker(worker_id: int, queue: JoinableQueue, failed: Event, written: Value):
+    """
+    Writes the batches it receives through the queue with its own session until it receives None.
+    After a failed batch the remaining ones are only taken off the queue, so the parent doesn't
+    block, and the worker exits with an error
+    :param worker_id: the number of the worker used for the progress output
+    :param queue: the queue holding (query, rows) tuples
+    :param failed: set once a batch couldn't be written
+    :param written: the amount of relationships written by all workers
+    """
+    db.set_connection(config.DATABASE_URL)
+    error = None
+    worker_written = 0
+    with db.driver.session() as session:
+        run_query = retry_transient(lambda query, params: session.run(query, params).consume())
+        for query, rows in iter(queue.get, None):
+            try:
+                if error is None:
+                    run_query(query, {"rows": rows})
+                    worker_written += len(rows)
+                    with written.get_lock():
+                        written.value += len(rows)
+                    print(f"Worker {worker_id}: wrote {worker_written} relationships")
+            except Exception as e:
+                error = e
+                failed.set()
+                print(f"Worker {worker_id}: couldn't write a batch: {e!r}")
+            finally:
+                queue.task_done()
+    queue.task_done()
+    db.driver.close()
+    if error is not None:
+        raise error
 
 
-def parse_relationships(wordlist: list):
+def parse_relationships(wordlist: list, batch_size: int = 5000, workers: int = 1,
+                        start: int = 0, on_commit=None, commit_interval: int = 5000):
     """
-    Parses all of the relationships for the synsets/words provided
+    Parses all of the relationships for the synsets/words provided and writes them in batches
     :param wordlist: a list of synsets
+    :param batch_size: the amount of relationships of one type that are written per statement
+    :param workers: the amount of processes writing the relationships. Relationships are
+    partitioned by their start node so concurrent writers rarely lock the same nodes
+    :param start: the offset of the first synset whose relationships should be written
+    :param on_commit: optional function that's called with the offset once all the
+    relationships of the synsets before it have been written
+    :param commit_interval: the amount of synsets after which all pending batches are written
+    and on_commit is called
     """
-    insert_helper = InsertHelper()
-    i = 0
     print("ADDING RELATIONSHIPS")
-    for synset in wordlist:
-        insert_helper.set_synset_relationships(synset)
-        for lemma in synset.lemmas():
-            insert_helper.set_lemma_relationships(synset, lemma)
-        i += 1
-        if i % 100 == 0:
-            print(i)
+    failed, written = Event(), Value('q', 0)
+    if workers <= 1:
+        queues = []
+        writers = [RelationshipBatchWriter(batch_size)]
+    else:
+        queues = [JoinableQueue(maxsize=4) for _ in range(workers)]
+        processes = [Process(target=relationship_worker, args=(worker_id, queue, failed, written))
+                     for worker_id, queue in enumerate(queues)]
+        for process in processes:
+            process.start()
+        writers = [RelationshipBatchWriter(
+            batch_size, lambda query, params, queue=queue: queue.put((query, params["rows"])))
+            for queue in queues]
+
+    def stop():
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join()
+        failed_processes = [process for process in processes if process.exitcode != 0]
+        if len(failed_processes) > 0:
+            raise RuntimeError(f"{len(failed_processes)} of the relationship workers failed")
+
+    def commit(offset):
+        for writer in writers:
+            writer.flush()
+        # Wait until the workers actually wrote everything that has been handed to them
+        for queue in queues:
+            queue.join()
+        if failed.is_set():
+            # The checkpoint must not skip the batches that weren't written
+            stop()
+            raise RuntimeError("A relationship worker failed")
+        if on_commit is not None:
+            on_commit(offset)
+
+    for i in range(start, len(wordlist)):
+        for edge in InsertHelper.synset_edges(wordlist[i]):
+            writers[zlib.crc32(edge[3].encode()) % len(writers)].add(*edge)
+        if (i + 1) % commit_interval == 0:
+            commit(i + 1)
+            if workers <= 1:
+                print(i + 1)
+    commit(len(wordlist))
+    if workers > 1:
+        stop()
+        print(f"Wrote {written.value} relationships")
+    else:
+        print(f"Wrote {writers[0].written} relationships")
+
+
+STAGES = ["nodes", "relationships", "classify", "wordvectors"]
+
+
+def run_stages(stages: list, checkpoint: Checkpoint, args):
+    """
+    Runs the given insertion stages in order and records the progress in the checkpoint.
+    Stages that are already completed are skipped and a started stage continues from its offset
+    :param stages: the names of the stages that should be run
+    :param checkpoint: the checkpoint keeping track of the progress
+    :param args: the parsed command line arguments
+    """
+    synsets = None
+    insert_helper = InsertHelper(args.wv_model)
+    for stage in [stage for stage in STAGES if stage in stages]:
+        if checkpoint.is_completed(stage):
+            print(f"Skipping completed stage {stage}")
+            continue
+        start = checkpoint.start_offset(stage)
+        on_commit = lambda offset, stage=stage: checkpoint.commit(stage, offset)
+        if stage in ("nodes", "relationships") and synsets is None:
+            synsets = list(wn.all_synsets())
+        if stage == "nodes":
+            print("Inserting wordnet data")
+            parse_nodes(synsets, start, on_commit)
+        elif stage == "relationships":
+            print("Inserting relationships")
+            parse_relationships(synsets, args.batch_size, args.workers, start, on_commit)
+        elif stage == "classify":
+            print("Classifying objects")
+            insert_helper.classify_objects()
+            print("Classifying RootWord objects")
+            insert_helper.classify_root_word_objects()
+        elif stage == "wordvectors":
+            print("Adding wordvector relations")
+            insert_helper.add_wv_relations(args.topk, args.min_score, args.block_size,
+                                           args.batch_size, args.wv_all, args.ann,
+                                           args.ann_index, args.nprobe, args.ef,
+                                           args.check_recall)
+        checkpoint.complete(stage)
 
 
 def main():
     parser = argparse.ArgumentParser(description="Insert Wordnet data into neo4j")
     parser.add_argument('--a', help="Parser everything into the database", const=True, nargs='?')
     parser.add_argument('--wr', help="Add all wordvector relations", const=True, nargs='?')
+    parser.add_argument('--stages', help="Comma separated stages that should be run out of "
+                                         f"{','.join(STAGES)}")
+    parser.add_argument('--resume', help="Continue from the last checkpoint", const=True,
+                        nargs='?')
+    parser.add_argument('--checkpoint', help="File the progress is recorded in",
+                        default="insert_checkpoint.json", metavar="PATH")
+    parser.add_argument('--batch-size', help="Amount of relationships written per statement",
+                        default=5000, type=int, dest="batch_size")
+    parser.add_argument('--workers', help="Amount of processes writing the relationships",
+                        default=1, type=int)
+    parser.add_argument('--topk', help="Amount of similar root words per root word object",
+                        default=10, type=int)
+    parser.add_argument('--min-score', help="Minimal similarity of a wordvector relation",
+                        default=None, type=float, dest="min_score")
+    parser.add_argument('--block-size', help="Amount of root words compared at once when "
+                                             "adding wordvector relations",
+                        default=1024, type=int, dest="block_size")
+    parser.add_argument('--wv-model', help="Word vector model file that's memory-mapped, or a "
+                                           "directory the trained model is cached in",
+                        dest="wv_model", metavar="PATH")
+    parser.add_argument('--wv-all', help="Add wordvector relations for all root words instead "
+                                         "of only the object root words", const=True,
+                        nargs='?', dest="wv_all", default=False)
+    parser.add_argument('--ann', help="Nearest neighbour index used for the wordvector "
+                                      "relations", choices=["exact", "ivf", "hnsw"],
+                        default="exact")
+    parser.add_argument('--ann-index', help="File the approximate index is loaded from or saved "
+                                            "to", dest="ann_index", metavar="PATH")
+    parser.add_argument('--nprobe', help="Clusters searched per word by the ivf index, higher "
+                                         "values improve recall", default=8, type=int)
+    parser.add_argument('--ef', help="Candidate list size of the hnsw index, higher values "
+                                     "improve recall", default=50, type=int)
+    parser.add_argument('--check-recall', help="Print the recall of the index compared to the "
+                                               "exact search on a sample of AMOUNT words",
+                        default=0, type=int, dest="check_recall", metavar="AMOUNT")
+    parser.add_argument('--export-csv', help="Write the wordnet data as neo4j-admin import csv "
+                                             "files into DIR instead of using the database",
+                        dest="export_csv", metavar="DIR")
     args = parser.parse_args()
 
+    if args.export_csv is not None:
+        export_csv(wn.all_synsets(), args.export_csv)
+        return
+
+    stages = []
+    if args.stages is not None:
+        stages = args.stages.split(",")
+        unknown = [stage for stage in stages if stage not in STAGES]
+        if len(unknown) > 0:
+            parser.error(f"Unknown stages: {','.join(unknown)}")
     if args.a is not None:
-        synset = wn.all_synsets()
-        print("Inserting wordnet data")
-        parse_nodes(list(synset))
-        print("Inserting relationships")
-        parse_relationships(synset)
-        print("Classifying objects")
-        insert_helper = InsertHelper()
-        insert_helper.classify_objects()
-        print("Classifying RootWord objects")
-        insert_helper.classify_root_word_objects()
+        stages += ["nodes", "relationships", "classify"]
     if args.wr is not None:
-        print("Adding wordvector relations")
-        insert_helper = InsertHelper()
-        insert_helper.add_wv_relations()
+        stages.append("wordvectors")
+
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.resume is not None:
+        checkpoint.load()
+    run_stages(stages, checkpoint, args)
 
 
 if __name__ == "__main__":
@@ -1,17 +1,58 @@
 from typing import Dict, List, Any
 
-from fill_multiple_mask import FillMoreMaskPipeline
-from transformers.pipelines.base import PipelineException
-from transformers import AutoTokenizer, AutoModelForMaskedLM
-from GraphModel import Object, Lemma, RootWord, RootWordObject
-from neomodel import DoesNotExist
-import torch
+from bert_backends import BACKENDS, load_backend
+from GraphModel import RootWord, SubsetRel
+from neomodel import db, config
+from prediction_cache import PredictionCache
+from relation_registry import RelationRegistry, read_templates
+from functools import lru_cache
+from multiprocessing import Process, Queue
+from multiprocessing.connection import wait
 import argparse
+import hashlib
+import numpy as np
+import os
+import time
 
-
-tokenizer = AutoTokenizer.from_pretrained("bert-base-cased")
-model = AutoModelForMaskedLM.from_pretrained("bert-base-cased", return_dict=True)
+# transformers, torch and the model are only loaded once they're needed, so importing this
+# module or running --help stays fast
+MODEL_NAME = "bert-base-cased"
 pipeline = None
+target_ids = None
+cache = None
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer():
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(MODEL_NAME)
+
+
+def get_id_to_str() -> np.ndarray:
+    """
+    :return: The decoded token string of every vocabulary id, the same table the pipeline uses
+    """
+    from fill_multiple_mask import vocabulary_strings
+    return vocabulary_strings(get_tokenizer())
+
+
+@lru_cache(maxsize=None)
+def get_model():
+    from transformers import AutoModelForMaskedLM
+    return AutoModelForMaskedLM.from_pretrained(MODEL_NAME, return_dict=True)
+
+
+def select_framework(framework: str = None) -> None:
+    """
+    Restricts transformers to PyTorch, the only framework the model and the backends are
+    loaded with. Has to be called before transformers is imported, TensorFlow is then never
+    imported even if it's installed
+    :param framework: pt or None to let transformers decide
+    """
+    if framework == "pt":
+        os.environ["USE_TORCH"] = "1"
+        os.environ["USE_TF"] = "0"
+
 
 # TODO: Rename self.sentences
 
@@ -31,16 +72,7 @@ class RelationPrefab:
         Loads all the predefined sentences from the specified file
         :param path: path to the relation file
         """
-        sentence_list = []
-        with open(path, 'r') as file:
-            for line in file:
-                if line.startswith("#"):
-                    continue
-                index = line.find(";")
-                relation = {"sentence": line[0:index],
-                            "relation_name": f"BERT_{line[index + 1:]}".rstrip()}
-                sentence_list.append(relation)
-        self.sentences = {"sentences": sentence_list}
+        self.sentences = {"sentences": read_templates(path)}
 
     def get_filled_sentences(self, word: str) -> Dict[str, List[Dict[str, Any]]]:
         """
@@ -56,43 +88,310 @@ class RelationPrefab:
         return {"sentences": outsentences}
 
 
-def top_n_mask(json_data, args) -> dict:
-    global tokenizer
-    global model
+class SentenceBatcher:
+    """
+    Packs the filled sentences of many words into batches. Sentences are sorted by their token
+    length within a bucket of several batches, so every batch needs as little padding as possible
+    """
+
+    def __init__(self, prefab: RelationPrefab, max_batch_size: int = 64, bucket_batches: int = 8):
+        """
+        :param prefab: The relation sentences that are filled with every word
+        :param max_batch_size: The maximal amount of sentences per batch
+        :param bucket_batches: The amount of batches whose sentences are sorted by length together
+        """
+        self.prefab = prefab
+        self.max_batch_size = max_batch_size
+        self.bucket_size = max_batch_size * bucket_batches
+
+    def split_bucket(self, bucket: List[Dict[str, Any]], full_only: bool = False):
+        """
+        Sorts a bucket by length and yields it as batches
+        :param bucket: The sentences of the bucket
+        :param full_only: Only yield full batches and keep the remaining sentences in the bucket
+        """
+        bucket.sort(key=lambda item: item["length"])
+        end = len(bucket) - len(bucket) % self.max_batch_size if full_only else len(bucket)
+        for i in range(0, end, self.max_batch_size):
+            yield bucket[i:min(i + self.max_batch_size, end)]
+        del bucket[:end]
+
+    def batches(self, words):
+        """
+        :param words: An iterable of word names
+        :return: Generator of batches, each a list of dicts with the word, the relation name and
+        the filled sentence
+        """
+        bucket = []
+        for word in words:
+            for sentence in self.prefab.get_filled_sentences(word)["sentences"]:
+                bucket.append({"word": word, "relation_name": sentence["relation_name"],
+                               "sentence": sentence["sentence"],
+                               "length": len(get_tokenizer().tokenize(sentence["sentence"]))})
+            if len(bucket) >= self.bucket_size:
+                yield from self.split_bucket(bucket, full_only=True)
+        yield from self.split_bucket(bucket)
+
+
+def root_word_token_ids(id_to_str: np.ndarray) -> np.ndarray:
+    """
+    Builds the index of all the vocabulary ids whose decoded token is the name of a RootWord
+    :param id_to_str: The decoded token string of every vocabulary id
+    :return: The vocabulary ids
+    """
+    results, _ = db.cypher_query("MATCH (r:RootWord) RETURN r.name")
+    names = {name for name, in results}
+    return np.array([id_ for id_, token in enumerate(id_to_str) if token in names])
+
+
+def create_pipeline(backend: str = "pt", gpu_device=-1, onnx_path: str = None,
+                    threads: int = 0, framework: str = None):
+    """
+    Creates the pipeline running the model with the given inference backend
+    :param backend: One of pt, int8 or onnx
+    :param gpu_device: The gpu device to be used, only supported by the pt backend
+    :param onnx_path: The file the ONNX model is loaded from or exported to
+    :param threads: The amount of threads used for inference, 0 keeps the default
+    :param framework: The framework passed to the pipeline, None lets transformers decide
+    :return: The FillMoreMaskPipeline
+    """
+    from fill_multiple_mask import FillMoreMaskPipeline
+    if gpu_device != -1 and backend != "pt":
+        raise ValueError(f"The {backend} backend only runs on the cpu")
+    backend_model = load_backend(backend, get_model(), get_tokenizer(), onnx_path, threads)
+    return FillMoreMaskPipeline(backend_model, get_tokenizer(), framework=framework,
+                                device=0 if gpu_device != -1 else -1,
+                                check_model=backend != "onnx")
+
+
+def cache_model_key(args) -> str:
+    """
+    :param args: The parsed command line arguments
+    :return: Identifies the predictions of this model, backend and target restriction in the cache
+    """
+    if args.unrestricted:
+        return f"{MODEL_NAME}:{args.backend}:all"
+    digest = hashlib.sha1(target_ids.astype(np.int64).tobytes()).hexdigest()
+    return f"{MODEL_NAME}:{args.backend}:{digest}"
+
+
+def predict_batch(batch: List[Dict[str, Any]], args, top_k: int = 5) -> List[Dict[str, Any]]:
+    """
+    Runs a batch of filled sentences through the pipeline. Sentences found in the prediction
+    cache aren't predicted again
+    :param batch: Dicts holding a sentence with a {mask} placeholder
+    :param args: The parsed command line arguments
+    :param top_k: The amount of predictions per mask
+    :return: The pipeline result of every sentence
+    """
     global pipeline
-    top_k = 5
-    targets = None
-    masktoken = tokenizer.mask_token
-
-    if 'sentences' in json_data:
-        sentences = json_data['sentences']
-    else:
-        return {"error": "sentences are missing"}
-
-    if "top_k" in json_data:
-        top_k = int(json_data['top_k'])
-    if "targets" in json_data:
-        if len(json_data['targets']) > 0:
-            targets = json_data['targets']
-
-    # Platzhaltermaske durch Modellspezifische Maske austauschen
-    model_inputs = [sent["sentence"].format(mask=masktoken) for sent in sentences]
-
-    #  https://huggingface.co/transformers/_modules/transformers/pipelines/fill_mask.html
-    if pipeline is None:
-        if args.gpu_device != -1:
-            pipeline = FillMoreMaskPipeline(model, tokenizer, device=0)
-        else:
-            pipeline = FillMoreMaskPipeline(model, tokenizer)
+    global target_ids
+    global cache
+    if target_ids is None and not args.unrestricted:
+        # Every prediction is a token that exists as a RootWord
+        target_ids = root_word_token_ids(get_id_to_str())
+    if cache is None and args.cache:
+        cache = PredictionCache(args.cache, cache_model_key(args))
+    model_inputs = [item["sentence"].format(mask=get_tokenizer().mask_token) for item in batch]
+    cached = cache.get_many(model_inputs, top_k) if cache is not None else {}
+    missing = list(dict.fromkeys(sentence for sentence in model_inputs if sentence not in cached))
+    if len(missing) > 0:
+        import torch
+        if pipeline is None:
+            pipeline = create_pipeline(args.backend, args.gpu_device, args.onnx_path,
+                                       args.threads, args.framework)
+            pipeline.target_ids = target_ids
+        with torch.inference_mode():
+            results = pipeline(missing, top_k=top_k)
+        if len(missing) == 1:
+            results = [results]
+        predicted = {sentence: ([[value["token"] for value in mask_result]
+                                 for mask_result in result["mask_results"]],
+                                [[value["score"] for value in mask_result]
+                                 for mask_result in result["mask_results"]])
+                     for sentence, result in zip(missing, results)}
+        if cache is not None:
+            cache.put_many(predicted, top_k)
+        cached.update(predicted)
+    id_to_str = get_id_to_str()
+    return [{"mask_results": [[{"score": score, "token": token, "token_str": id_to_str[token]}
+                               for token, score in zip(mask_ids, mask_scores)]
+                              for mask_ids, mask_scores in zip(*cached[sentence])]}
+            for sentence in model_inputs]
+
+
+def predict_words(words, prefab: RelationPrefab, args):
+    """
+    Predicts the relations of the words in batches
+    :param words: An iterable of word names
+    :param prefab: The relation sentences that are filled with every word
+    :param args: The parsed command line arguments
+    :return: Generator of (word, predictions) once all the sentences of a word are predicted.
+    The predictions are a list of (relation_name, token_str, score) tuples or None if the word
+    couldn't be processed
+    """
+    from transformers.pipelines.base import PipelineException
+    sentences_per_word = len(prefab.sentences["sentences"])
+    batcher = SentenceBatcher(prefab, args.batch_size, args.bucket_batches)
+    pending = {}
+    for batch in batcher.batches(words):
+        try:
+            results = predict_batch(batch, args)
+        except PipelineException as e:
+            print(f"Couldn't process batch: {e}")
+            results = [None] * len(batch)
+        for item, result in zip(batch, results):
+            word_results = pending.setdefault(item["word"], [])
+            word_results.append((item["relation_name"], result))
+            if len(word_results) < sentences_per_word:
+                continue
+            # All sentences of the word are predicted
+            del pending[item["word"]]
+            if any(word_result is None for _, word_result in word_results):
+                yield item["word"], None
+                continue
+            predictions = []
+            for relation_name, word_result in word_results:
+                for mask_result in word_result["mask_results"]:
+                    # TODO: Handle multiple masks
+                    for value in mask_result:
+                        predictions.append((relation_name, value["token_str"], value["score"]))
+            yield item["word"], predictions
+    if cache is not None:
+        print(f"Prediction cache: {cache.hits} hits, {cache.misses} misses")
+
+
+def inference_worker(words: list, prefab: RelationPrefab, args, queue: Queue,
+                     worker_target_ids: np.ndarray = None):
+    """
+    Predicts the relations of its share of the words and passes them to the writer
+    :param words: The word names of this worker
+    :param prefab: The relation sentences that are filled with every word
+    :param args: The parsed command line arguments
+    :param queue: The queue the (word, predictions) tuples are put into, None marks the end
+    :param worker_target_ids: The target token ids computed by the parent, so the worker doesn't
+    have to query them
+    """
+    global target_ids
+    # The driver of the parent can't be shared across the fork
+    db.set_connection(config.DATABASE_URL)
+    target_ids = worker_target_ids
     try:
-        results = pipeline(model_inputs, top_k=top_k, targets=targets)
-    except PipelineException as e:
-        return {"error": str(e)}
+        for word, predictions in predict_words(words, prefab, args):
+            queue.put((word, predictions))
+    finally:
+        # The writer has to learn about the end even if this worker fails
+        queue.put(None)
 
-    for sent, result in zip(sentences, results):
-        sent["results"] = result
 
-    return {"sentences": sentences}
+def count_words() -> int:
+    """
+    :return: The amount of RootWordObjects in the db
+    """
+    results, _ = db.cypher_query("MATCH (r:RootWordObject) RETURN count(r)")
+    return results[0][0]
+
+
+def unprocessed_words(processed: set, page_size: int = 10000):
+    """
+    Streams the names of the RootWordObjects page by page, ordered by name
+    :param processed: The names that are skipped
+    :param page_size: The amount of names fetched per query
+    :return: Generator of the names that aren't in processed
+    """
+    last = ""
+    while True:
+        results, _ = db.cypher_query(
+            """MATCH (r:RootWordObject)
+            WHERE r.name > $last
+            RETURN r.name ORDER BY r.name LIMIT $limit""", {"last": last, "limit": page_size})
+        for name, in results:
+            if name not in processed:
+                yield name
+        if len(results) < page_size:
+            return
+        last = results[-1][0]
+
+
+def aggregate_predictions(predictions: list, aggregate: str = "max",
+                          min_weight: float = 0.0) -> dict:
+    """
+    Combines the predictions of one word, so every (relation, token) pair becomes one weighted
+    relationship even if it's predicted by several masks or sentences
+    :param predictions: A list of (relation_name, token_str, score) tuples
+    :param aggregate: max keeps the highest score, sum adds the scores up
+    :param min_weight: Pairs whose combined weight is below this are dropped
+    :return: A dict mapping (relation_name, token_str) to the weight
+    """
+    weights = {}
+    for relation_name, token_str, score in predictions:
+        key = (relation_name, token_str)
+        if key not in weights:
+            weights[key] = score
+        elif aggregate == "sum":
+            weights[key] += score
+        else:
+            weights[key] = max(weights[key], score)
+    return {key: weight for key, weight in weights.items() if weight >= min_weight}
+
+
+def write_predictions(results, args, amount: int, mark_interval: int = 1000) -> None:
+    """
+    Writes the aggregated relations of the words in batches. Once the relations of a word are
+    flushed it's marked complete, so a resumed run skips it even if pruning left some relation
+    types without a relationship or its sentences couldn't be processed
+    :param results: An iterable of (word, predictions) tuples
+    :param args: The parsed command line arguments
+    :param amount: The amount of words, used for the progress output
+    :param mark_interval: The amount of words after which everything is flushed and marked
+    """
+    registry = RelationRegistry(args.file)
+    writer = registry.writer(args.write_batch_size)
+    done = 0
+    pending = []
+    start = time.time()
+    for word, predictions in results:
+        done += 1
+        pending.append(word)
+        if predictions is None:
+            print(f"Couldn't process: {word}")
+        else:
+            weights = aggregate_predictions(predictions, args.aggregate, args.min_weight)
+            for (relation_name, token_str), weight in weights.items():
+                writer.add_relation(word, relation_name, token_str, weight)
+        if len(pending) >= mark_interval:
+            writer.flush()
+            registry.mark_complete(pending)
+            pending = []
+        if done % 200 == 0:
+            print(f"Added Bert relations for {done}/{amount} items "
+                  f"({done / (time.time() - start):.1f} words/s)")
+    writer.flush()
+    registry.mark_complete(pending)
+    print(f"Added {writer.written} Bert relations for {done} items "
+          f"({done / (time.time() - start):.1f} words/s)")
+
+
+def writer_worker(queue: Queue, producers: int, args, amount: int) -> None:
+    """
+    Writes the predictions of all inference workers until each of them has finished
+    :param queue: The queue holding (word, predictions) tuples, None marks the end of a producer
+    :param producers: The amount of inference workers
+    :param args: The parsed command line arguments
+    :param amount: The amount of words, used for the progress output
+    """
+    # The driver of the parent can't be shared across the fork
+    db.set_connection(config.DATABASE_URL)
+
+    def results():
+        finished = 0
+        while finished < producers:
+            item = queue.get()
+            if item is None:
+                finished += 1
+            else:
+                yield item
+    write_predictions(results(), args, amount)
 
 
 def main():
@@ -104,37 +403,86 @@ def main():
                         dest="gpu_device", required=False, metavar="DEVICEID")
     parser.add_argument('-file', help="Specify the location of the relation file", required=True,
                         metavar="PATH")
+    parser.add_argument('-batch-size', help="Maximal amount of sentences per inference batch",
+                        default=64, type=int, dest="batch_size")
+    parser.add_argument('-bucket-batches', help="Amount of batches whose sentences are sorted by "
+                                                "length together", default=8, type=int,
+                        dest="bucket_batches")
+    parser.add_argument('-unrestricted', help="Predict over the whole vocabulary instead of only "
+                                              "the tokens that exist as RootWord",
+                        dest="unrestricted", const=True, default=False, nargs='?')
+    parser.add_argument('-framework', '--framework', help="Only load this framework, pt skips "
+                                                          "importing TensorFlow",
+                        choices=["pt"], default=None)
+    parser.add_argument('-backend', help="Inference backend of the model", choices=BACKENDS,
+                        default="pt")
+    parser.add_argument('-onnx-path', help="File the ONNX model is loaded from or exported to",
+                        dest="onnx_path", metavar="ONNXPATH")
+    parser.add_argument('-threads', help="Amount of threads used for inference, per process with "
+                                         "-procs", default=0, type=int)
+    parser.add_argument('-procs', '--procs', help="Amount of inference processes, their results "
+                                                  "are written by one writer process",
+                        default=1, type=int)
+    parser.add_argument('-write-batch-size', help="Amount of relationships written per statement",
+                        default=5000, type=int, dest="write_batch_size")
+    parser.add_argument('-aggregate', '--aggregate', help="How the scores of a token predicted "
+                                                          "several times for the same relation "
+                                                          "are combined",
+                        choices=["max", "sum"], default="max")
+    parser.add_argument('-min-weight', '--min-weight', help="Relationships with a smaller weight "
+                                                            "aren't written",
+                        default=0.0, type=float, dest="min_weight")
+    parser.add_argument('-cache', help="Sqlite file caching the predictions of every sentence, an "
+                                       "empty string disables the cache",
+                        default="bert_predictions.sqlite", metavar="CACHEPATH")
+    parser.add_argument('-page-size', help="Amount of word names fetched per query",
+                        default=10000, type=int, dest="page_size")
     args = parser.parse_args()
-
+    select_framework(args.framework)
 
     prefab = RelationPrefab(args.file)
-    amount = len(list(RootWordObject.nodes))
-    i = 0
-    root_word: RootWordObject
-    for root_word in RootWordObject.nodes:
-        data = prefab.get_filled_sentences(root_word.name)
-        if i % 200 == 0:
-            print(f"Added Bert relations for {i}/{amount} items")
-        i += 1
-        if root_word.bert_is.single() is not None:
-            continue
-        results = top_n_mask(data, args)
-        if "error" in results or "sentences" not in results:
-            print(f"Couldn't process: {root_word.name}")
-            continue
-        for sentence in results["sentences"]:
-            relation_name = sentence["relation_name"]
-            for mask_result in sentence["results"]["mask_results"]:
-                # TODO: Handle multiple masks
-                for value in mask_result:
-                    node_name = value["token_str"]
-                    try:
-                        nody = RootWord.nodes.get(name=node_name)
-                        rel = root_word.__dict__[relation_name.lower()].connect(nody)
-                        rel.weight = value["score"]
-                        rel.save()
-                    except DoesNotExist:
-                        pass
+    registry = RelationRegistry(args.file)
+    # Relations that were only added to this file are defined on the model as well
+    registry.register(RootWord, SubsetRel)
+    processed = registry.complete_sources()
+    amount = count_words() - len(processed)
+    print(f"Skipping {len(processed)} processed items")
+
+    if args.procs <= 1:
+        write_predictions(predict_words(unprocessed_words(processed, args.page_size), prefab,
+                                        args), args, amount)
+        return
+
+    words = list(unprocessed_words(processed, args.page_size))
+    if args.threads <= 0:
+        args.threads = max(1, (os.cpu_count() or 1) // args.procs)
+    worker_target_ids = None if args.unrestricted else root_word_token_ids(get_id_to_str())
+    queue = Queue(maxsize=args.procs * 64)
+    writer = Process(target=writer_worker, args=(queue, args.procs, args, len(words)))
+    writer.start()
+    workers = [Process(target=inference_worker,
+                       args=(words[i::args.procs], prefab, args, queue, worker_target_ids))
+               for i in range(args.procs)]
+    for worker in workers:
+        worker.start()
+    while any(worker.is_alive() for worker in workers):
+        wait([worker.sentinel for worker in workers] +
+             ([writer.sentinel] if writer.is_alive() else []), timeout=5)
+        if not writer.is_alive() and writer.exitcode != 0:
+            # The workers would block forever on the full queue
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+            raise RuntimeError(f"The writer process failed with exit code {writer.exitcode}")
+    for worker in workers:
+        if worker.exitcode < 0 and writer.is_alive():
+            # Killed by a signal before it could mark its end
+            queue.put(None)
+    writer.join()
+    failed = [process for process in workers + [writer] if process.exitcode != 0]
+    if len(failed) > 0:
+        raise RuntimeError(f"{len(failed)} of the processes failed")
 
 
 if __name__ == "__main__":
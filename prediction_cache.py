@@ -0,0 +1,65 @@
+import json
+import sqlite3
+
+"""
+On-disk cache of the masked language model predictions. For every filled sentence the top k
+token ids and scores of each mask are stored, keyed by the model (including the backend and the
+target restriction) and the sentence, so a rerun only has to predict the sentences it hasn't seen
+"""
+
+
+class PredictionCache:
+
+    def __init__(self, path: str, model: str, chunk_size: int = 500):
+        """
+        :param path: The sqlite file, it's created if it doesn't exist
+        :param model: Identifies the model, predictions of other models are never returned
+        :param chunk_size: The amount of sentences looked up per query
+        """
+        self.model = model
+        self.chunk_size = chunk_size
+        self.hits = 0
+        self.misses = 0
+        # Several inference processes may share the file
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS predictions (
+            model TEXT NOT NULL,
+            sentence TEXT NOT NULL,
+            top_k INTEGER NOT NULL,
+            ids TEXT NOT NULL,
+            scores TEXT NOT NULL,
+            PRIMARY KEY (model, sentence))""")
+        self.connection.commit()
+
+    def get_many(self, sentences: list, top_k: int) -> dict:
+        """
+        :param sentences: The filled sentences
+        :param top_k: The amount of predictions per mask that are needed
+        :return: A dict mapping every cached sentence to its token ids and scores per mask. Entries
+        that were stored with a smaller top k are treated as missing
+        """
+        found = {}
+        for i in range(0, len(sentences), self.chunk_size):
+            chunk = sentences[i:i + self.chunk_size]
+            rows = self.connection.execute(
+                f"""SELECT sentence, ids, scores FROM predictions
+                WHERE model = ? AND top_k >= ? AND sentence IN ({','.join('?' * len(chunk))})""",
+                [self.model, top_k] + chunk)
+            for sentence, ids, scores in rows:
+                found[sentence] = ([mask_ids[:top_k] for mask_ids in json.loads(ids)],
+                                   [mask_scores[:top_k] for mask_scores in json.loads(scores)])
+        self.hits += len(found)
+        self.misses += len(sentences) - len(found)
+        return found
+
+    def put_many(self, predictions: dict, top_k: int) -> None:
+        """
+        :param predictions: A dict mapping sentences to their (token ids, scores) per mask
+        :param top_k: The amount of predictions per mask that were requested
+        """
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)",
+            [(self.model, sentence, top_k, json.dumps(ids), json.dumps(scores))
+             for sentence, (ids, scores) in predictions.items()])
+        self.connection.commit()
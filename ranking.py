@@ -0,0 +1,191 @@
+import numpy as np
+
+from filter_index import FilterIndex
+
+"""
+Filtered ranking of test triples against corruptions with the embeddings of a trained model.
+The corruptions of a block of test triples are scored with one matrix multiplication and the
+known triples are masked through the sorted FilterIndex, so the whole test set can be ranked
+against large entity subsets
+"""
+
+
+def complex_queries(entities: np.ndarray, relations: np.ndarray, side: str) -> np.ndarray:
+    """
+    Turns the fixed entity and relation of ComplEx triples into query vectors, so the scores of
+    all the corruptions are the dot products with the candidate entity embeddings
+    :param entities: The embeddings of the fixed entities, real parts followed by imaginary parts
+    :param relations: The embeddings of the relations in the same layout
+    :param side: o when the objects are corrupted, s when the subjects are
+    :return: The query vectors, one per row
+    """
+    k = entities.shape[1] // 2
+    entity = entities[:, :k] + 1j * entities[:, k:]
+    relation = relations[:, :k] + 1j * relations[:, k:]
+    if side == "o":
+        # Re(<e_s, w_p, conj(e_o)>) = Re(e_s * w_p) . Re(e_o) + Im(e_s * w_p) . Im(e_o)
+        query = entity * relation
+        return np.concatenate((query.real, query.imag), axis=1).astype(np.float32)
+    # Re(<e_s, w_p, conj(e_o)>) = Re(e_s) . Re(w_p * conj(e_o)) - Im(e_s) . Im(w_p * conj(e_o))
+    query = relation * np.conj(entity)
+    return np.concatenate((query.real, -query.imag), axis=1).astype(np.float32)
+
+
+SCORERS = {"ComplEx": complex_queries}
+
+
+def lookup(keys: np.ndarray, rows: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    :param keys: Sorted ids
+    :param rows: The row of every id
+    :param values: The ids that are looked up
+    :return: The row of every value, -1 for the values that aren't in keys
+    """
+    if len(keys) == 0:
+        return np.full(np.shape(values), -1, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(keys, values), len(keys) - 1)
+    return np.where(keys[positions] == values, rows[positions], -1)
+
+
+class RankingEngine:
+
+    def __init__(self, entity_ids: np.ndarray, entity_embeddings: np.ndarray,
+                 relation_ids: np.ndarray, relation_embeddings: np.ndarray,
+                 model: str = "ComplEx", block_size: int = 128):
+        """
+        :param entity_ids: The ids of the entities in the triples, one per embedding row
+        :param entity_embeddings: The entity embeddings
+        :param relation_ids: The ids of the relations in the triples, one per embedding row
+        :param relation_embeddings: The relation embeddings
+        :param model: The scoring function, one of SCORERS
+        :param block_size: The amount of test triples ranked at once
+        """
+        if model not in SCORERS:
+            raise ValueError(f"Unknown model {model}")
+        self.queries = SCORERS[model]
+        order = np.argsort(entity_ids)
+        self.entity_keys, self.entity_rows = np.asarray(entity_ids)[order], order
+        order = np.argsort(relation_ids)
+        self.relation_keys, self.relation_rows = np.asarray(relation_ids)[order], order
+        self.entity_embeddings = np.asarray(entity_embeddings, dtype=np.float32)
+        self.relation_embeddings = np.asarray(relation_embeddings, dtype=np.float32)
+        self.block_size = block_size
+
+    @classmethod
+    def from_model(cls, model, block_size: int = 128):
+        """
+        :param model: A trained ampligraph model
+        :param block_size: The amount of test triples ranked at once
+        :return: An engine using the embeddings of the model
+        """
+        entity_ids = np.array(list(model.ent_to_idx.keys()))
+        relation_ids = np.array(list(model.rel_to_idx.keys()))
+        return cls(entity_ids, model.get_embeddings(entity_ids, embedding_type='entity'),
+                   relation_ids, model.get_embeddings(relation_ids, embedding_type='relation'),
+                   type(model).__name__, block_size)
+
+    def rank_side(self, triples: np.ndarray, rows: np.ndarray, side: str,
+                  candidates: np.ndarray, candidate_rows: np.ndarray, index: FilterIndex,
+                  strategy: str) -> np.ndarray:
+        """
+        Ranks a block of triples against the corruptions of one side
+        :param triples: The raw triples of the block
+        :param rows: Their (subject, relation, object) embedding rows
+        :param side: s or o
+        :param candidates: The sorted ids of the entities used for the corruptions
+        :param candidate_rows: Their embedding rows
+        :param index: The FilterIndex of the known triples, None ranks unfiltered
+        :param strategy: How ties are ranked, worst, best or middle
+        :return: The rank of every triple
+        """
+        fixed, corrupted = (0, 2) if side == "o" else (2, 0)
+        queries = self.queries(self.entity_embeddings[rows[:, fixed]],
+                               self.relation_embeddings[rows[:, 1]], side)
+        true_scores = np.einsum('ij,ij->i', queries, self.entity_embeddings[rows[:, corrupted]])
+        scores = queries @ self.entity_embeddings[candidate_rows].T
+        if index is not None:
+            if side == "o":
+                mask_rows, known = index.known_objects(triples[:, 0], triples[:, 1])
+            else:
+                mask_rows, known = index.known_subjects(triples[:, 1], triples[:, 2])
+            columns = lookup(candidates, np.arange(len(candidates)), known)
+            scores[mask_rows[columns >= 0], columns[columns >= 0]] = -np.inf
+        else:
+            # The true triple is never its own corruption
+            columns = lookup(candidates, np.arange(len(candidates)), triples[:, corrupted])
+            scores[np.nonzero(columns >= 0)[0], columns[columns >= 0]] = -np.inf
+        greater = (scores > true_scores[:, None]).sum(axis=1)
+        if strategy == "best":
+            return greater + 1
+        equal = (scores == true_scores[:, None]).sum(axis=1)
+        if strategy == "middle":
+            return greater + equal // 2 + 1
+        return greater + equal + 1
+
+    def rank(self, triples: np.ndarray, entities_subset: np.ndarray = None,
+             filter_triples: np.ndarray = None, index: FilterIndex = None,
+             corrupt_side: str = "s,o", strategy: str = "worst") -> np.ndarray:
+        """
+        Ranks every triple against the corruptions of its subject and its object, like
+        ampligraph's evaluate_performance with use_default_protocol and filter_unseen
+        :param triples: The raw (subject, relation, object) test triples
+        :param entities_subset: The entity ids used for the corruptions, all entities by default
+        :param filter_triples: The known triples that are filtered out of the corruptions
+        :param index: A prebuilt FilterIndex of the known triples, instead of filter_triples
+        :param corrupt_side: s, o or s,o
+        :param strategy: How ties are ranked, worst, best or middle
+        :return: The ranks, one column per corrupted side. Triples with entities or relations
+        the model hasn't seen are skipped
+        """
+        ranks = [block_ranks for _, block_ranks in
+                 self.iter_ranks(triples, entities_subset, filter_triples, index, corrupt_side,
+                                 strategy)]
+        if len(ranks) == 0:
+            return np.empty((0, len(corrupt_side.split(","))), dtype=np.int64)
+        return np.concatenate(ranks)
+
+    def iter_ranks(self, triples: np.ndarray, entities_subset: np.ndarray = None,
+                   filter_triples: np.ndarray = None, index: FilterIndex = None,
+                   corrupt_side: str = "s,o", strategy: str = "worst"):
+        """
+        Ranks the triples block by block, see rank
+        :return: Generator of (triples, ranks) per block, without the unseen triples
+        """
+        triples = np.asarray(triples, dtype=np.int64)
+        if index is None and filter_triples is not None:
+            index = FilterIndex(filter_triples)
+        if entities_subset is None:
+            candidates = self.entity_keys
+        else:
+            candidates = np.unique(np.asarray(entities_subset, dtype=self.entity_keys.dtype))
+            candidates = candidates[lookup(self.entity_keys, self.entity_rows, candidates) >= 0]
+        candidate_rows = lookup(self.entity_keys, self.entity_rows, candidates)
+        if len(candidates) == 0:
+            raise ValueError("None of the entities of entities_subset are known to the model")
+        sides = corrupt_side.split(",")
+        for start in range(0, len(triples), self.block_size):
+            block = triples[start:start + self.block_size]
+            rows = np.stack((lookup(self.entity_keys, self.entity_rows, block[:, 0]),
+                             lookup(self.relation_keys, self.relation_rows, block[:, 1]),
+                             lookup(self.entity_keys, self.entity_rows, block[:, 2])), axis=1)
+            seen = (rows >= 0).all(axis=1)
+            block, rows = block[seen], rows[seen]
+            if len(block) == 0:
+                continue
+            ranks = np.empty((len(block), len(sides)), dtype=np.int64)
+            for column, side in enumerate(sides):
+                ranks[:, column] = self.rank_side(block, rows, side, candidates, candidate_rows,
+                                                  index, strategy)
+            yield block, ranks
+
+
+def metrics(ranks: np.ndarray, hits: tuple = (1, 3, 10)) -> dict:
+    """
+    :param ranks: Ranks of any shape
+    :param hits: The n of the reported hits@n
+    :return: The mean rank, the mean reciprocal rank and the hits@n
+    """
+    ranks = np.asarray(ranks, dtype=np.float64).ravel()
+    result = {"mr": float(ranks.mean()), "mrr": float((1 / ranks).mean())}
+    result.update({f"H@{n}": float((ranks <= n).mean()) for n in hits})
+    return result
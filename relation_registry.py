@@ -0,0 +1,172 @@
+import os
+
+from neomodel import RelationshipTo, db
+
+from batch_writer import RelationshipBatchWriter
+
+"""
+Registry of the BERT relationship types. The types are read from a relations template file, so
+the node model, the writers and the readers stay in sync with the templates without editing
+GraphModel.py for every new relation
+"""
+
+RELATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "relations")
+
+
+def read_templates(path: str, prefix: str = "BERT_") -> list:
+    """
+    Reads a relations template file. Every line holds a sentence and the relation name
+    separated by a ;, lines starting with # are comments
+    :param path: The template file
+    :param prefix: Prepended to the relation names to get the relationship types
+    :return: A list of dicts with the sentence and the relationship type as relation_name
+    """
+    templates = []
+    with open(path, 'r') as file:
+        for line in file:
+            if line.startswith("#") or len(line.strip()) == 0:
+                continue
+            index = line.find(";")
+            templates.append({"sentence": line[0:index],
+                              "relation_name": f"{prefix}{line[index + 1:]}".rstrip()})
+    return templates
+
+
+class RelationWriter(RelationshipBatchWriter):
+    """
+    Batch writer that only accepts the weighted RootWord relationships of a registry
+    """
+
+    def __init__(self, registry, batch_size: int = 5000, run_query=None):
+        """
+        :param registry: The RelationRegistry holding the allowed relationship types
+        :param batch_size: The amount of rows that are written per statement
+        :param run_query: A function taking a query and its params. Defaults to db.cypher_query
+        """
+        super().__init__(batch_size, run_query)
+        self.registry = registry
+
+    def add_relation(self, source: str, relation_type: str, target: str, weight: float) -> None:
+        """
+        Queues a weighted relationship between two root words
+        :param source: The name of the source root word
+        :param relation_type: A relationship type of the registry
+        :param target: The name of the target root word
+        :param weight: The weight of the relationship
+        """
+        if relation_type not in self.registry.relation_types:
+            raise ValueError(f"Unknown relationship type {relation_type}")
+        self.add("RootWord", relation_type, "RootWord", source, target, weight)
+
+
+class RelationRegistry:
+
+    def __init__(self, path: str = RELATIONS_PATH, prefix: str = "BERT_"):
+        """
+        :param path: The relations template file
+        :param prefix: Prepended to the relation names to get the relationship types
+        """
+        self.templates = read_templates(path, prefix)
+        self.relation_types = list(dict.fromkeys(template["relation_name"]
+                                                 for template in self.templates))
+
+    @staticmethod
+    def attribute_name(relation_type: str) -> str:
+        """
+        :param relation_type: A relationship type
+        :return: The name of the attribute the relationship is defined as on the node model
+        """
+        return relation_type.lower()
+
+    def register(self, node_class, rel_model=None) -> list:
+        """
+        Defines every relationship type of the registry that's still missing on the node model
+        and its subclasses
+        :param node_class: The StructuredNode class the relationships start and end at
+        :param rel_model: The StructuredRel class of the relationships
+        :return: The relationship types that were added
+        """
+        added = []
+        for relation_type in self.relation_types:
+            attribute = self.attribute_name(relation_type)
+            if attribute in node_class.defined_properties(aliases=False, properties=False):
+                continue
+            setattr(node_class, attribute,
+                    RelationshipTo(node_class, relation_type, model=rel_model))
+            added.append(relation_type)
+        if len(added) > 0:
+            # neomodel caches the relationships of each class when it's created
+            classes = [node_class]
+            while len(classes) > 0:
+                cls = classes.pop()
+                cls.__all_relationships__ = tuple(
+                    cls.defined_properties(aliases=False, properties=False).items())
+                classes += cls.__subclasses__()
+        return added
+
+    def writer(self, batch_size: int = 5000, run_query=None) -> RelationWriter:
+        """
+        :param batch_size: The amount of rows that are written per statement
+        :param run_query: A function taking a query and its params. Defaults to db.cypher_query
+        :return: A batch writer for the relationship types of the registry
+        """
+        return RelationWriter(self, batch_size, run_query)
+
+    def read(self, sources: list, relation_types: list = None, batch_size: int = 5000):
+        """
+        Reads the relationships of the given root words without creating node objects
+        :param sources: The names of the source root words
+        :param relation_types: The relationship types that are read, defaults to all of the
+        registry
+        :param batch_size: The amount of source names per query
+        :return: Generator of (source, relation_type, target, weight) tuples
+        """
+        if relation_types is None:
+            relation_types = self.relation_types
+        for i in range(0, len(sources), batch_size):
+            results, _ = db.cypher_query(
+                """UNWIND $names AS name
+                MATCH (s:RootWord {name: name})-[r]->(t:RootWord)
+                WHERE type(r) IN $types
+                RETURN s.name, type(r), t.name, r.weight""",
+                {"names": sources[i:i + batch_size], "types": relation_types})
+            for row in results:
+                yield tuple(row)
+
+    def counts(self) -> dict:
+        """
+        :return: The amount of relationships of every type of the registry in the db
+        """
+        results, _ = db.cypher_query(
+            """MATCH (:RootWord)-[r]->(:RootWord)
+            WHERE type(r) IN $types
+            RETURN type(r), count(r)""", {"types": self.relation_types})
+        counts = dict.fromkeys(self.relation_types, 0)
+        counts.update({relation_type: count for relation_type, count in results})
+        return counts
+
+    def mark_complete(self, sources: list, batch_size: int = 5000) -> None:
+        """
+        Records that all the relationship types of the registry have been written for the given
+        root words, even if some of the types have no relationships after pruning
+        :param sources: The names of the source root words
+        :param batch_size: The amount of source names per query
+        """
+        for i in range(0, len(sources), batch_size):
+            db.cypher_query(
+                """UNWIND $names AS name
+                MATCH (r:RootWord {name: name})
+                SET r.completed_relations = [t IN coalesce(r.completed_relations, [])
+                                             WHERE NOT t IN $types] + $types""",
+                {"names": sources[i:i + batch_size], "types": self.relation_types})
+
+    def complete_sources(self) -> set:
+        """
+        :return: The names of the RootWordObjects marked complete for every type of the registry
+        """
+        results, _ = db.cypher_query(
+            """MATCH (r:RootWordObject)
+            WHERE r.completed_relations IS NOT NULL
+            AND all(t IN $types WHERE t IN r.completed_relations)
+            RETURN r.name""", {"types": self.relation_types})
+        return {name for name, in results}
@@ -0,0 +1,199 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from triple_store import load_triples
+
+"""
+Seeded train/valid/test splits of the evaluation triples that are computed once and stored on
+disk, keyed by a hash of the triples, the split sizes and the seed, so evaluate.py and
+best_model.py evaluate on the same splits and later runs only load them
+"""
+
+SPLIT_VERSION = 1
+
+
+def split_no_unseen(X: np.ndarray, test_size, seed: int = 0, allow_smaller: bool = False):
+    """
+    Greedy split in the spirit of ampligraph's train_test_split_no_unseen, but not a
+    reproduction of it: the triples are visited in a seeded random order and one is moved to the
+    test split as long as its entities and its relation still occur in the remaining triples.
+    The entities and relations are mapped to dense integer ids up front, so the greedy loop only
+    works with plain integers
+    :param X: The triples, one (subject, relation, object) row each
+    :param test_size: The amount of test triples or their fraction if it's a float
+    :param seed: The seed of the visiting order and of the final shuffle
+    :param allow_smaller: Return a smaller test split instead of raising if there aren't enough
+    triples that can be moved
+    :return: The (train, test) triples
+    """
+    random_state = np.random.RandomState(seed)
+    if isinstance(test_size, float):
+        test_size = int(len(X) * test_size)
+    size = X.shape[0]
+    _, entities = np.unique(np.concatenate((X[:, 0], X[:, 2])), return_inverse=True)
+    _, relations = np.unique(X[:, 1], return_inverse=True)
+    entity_counts = np.bincount(entities).tolist()
+    relation_counts = np.bincount(relations).tolist()
+    subjects, objects, relations = entities[:size].tolist(), entities[size:].tolist(), \
+        relations.tolist()
+
+    test = []
+    for idx in random_state.permutation(size).tolist():
+        subject, relation, object_ = subjects[idx], relations[idx], objects[idx]
+        entity_counts[subject] -= 1
+        relation_counts[relation] -= 1
+        entity_counts[object_] -= 1
+        if entity_counts[subject] > 0 and relation_counts[relation] > 0 and \
+                entity_counts[object_] > 0:
+            test.append(idx)
+            if len(test) == test_size:
+                break
+        else:
+            entity_counts[subject] += 1
+            relation_counts[relation] += 1
+            entity_counts[object_] += 1
+    if len(test) != test_size and not allow_smaller:
+        raise ValueError(f"Cannot create a test split of {test_size} triples without unseen "
+                         f"entities, only {len(test)} triples can be moved")
+    in_test = np.zeros(size, dtype=bool)
+    in_test[test] = True
+    X_train, X_test = X[~in_test], X[np.array(test, dtype=np.int64)]
+    return X_train[random_state.permutation(len(X_train))], \
+        X_test[random_state.permutation(len(X_test))]
+
+
+def split_triples(triples: np.ndarray, seed: int = 0, test_size: float = 0.7,
+                  valid_size: float = 0.5) -> dict:
+    """
+    Splits the triples in the way the evaluation scripts use them. The train split is the part
+    without unseen entities, the rest is split into valid and test so that every test entity
+    occurs in the valid split
+    :param triples: The triples
+    :param seed: The seed of both splits
+    :param test_size: The fraction of all triples that's split off as train
+    :param valid_size: The fraction of the rest that becomes the test split
+    :return: A dict with the train, valid and test triples
+    """
+    rest, train = split_no_unseen(triples, test_size, seed)
+    valid, test = split_no_unseen(rest, valid_size, seed, allow_smaller=True)
+    return {"train": train, "valid": valid, "test": test}
+
+
+def split_key(triples: np.ndarray, seed: int, test_size: float, valid_size: float) -> str:
+    """
+    :return: A hash identifying the splits of these triples with these parameters
+    """
+    digest = hashlib.sha1(np.ascontiguousarray(triples, dtype=np.int32).tobytes())
+    digest.update(json.dumps([SPLIT_VERSION, triples.shape[0], seed, test_size,
+                              valid_size]).encode())
+    return digest.hexdigest()
+
+
+def cached_splits(triples: np.ndarray, seed: int = 0, cache_dir: str = "splits",
+                  test_size: float = 0.7, valid_size: float = 0.5) -> dict:
+    """
+    Loads the splits from the cache directory or computes and stores them there
+    :param triples: The int32 triples
+    :param seed: The seed of the splits
+    :param cache_dir: The directory holding one directory per split key, None disables the cache
+    :param test_size: The fraction of all triples that's split off as train
+    :param valid_size: The fraction of the rest that becomes the test split
+    :return: A dict with the train, valid and test triples, memory-mapped if they were cached
+    """
+    if cache_dir is None:
+        return split_triples(triples, seed, test_size, valid_size)
+    directory = os.path.join(cache_dir, split_key(triples, seed, test_size, valid_size))
+    names = ["train", "valid", "test"]
+    if all(os.path.exists(os.path.join(directory, f"{name}.npy")) for name in names):
+        return {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+                for name in names}
+    splits = split_triples(triples, seed, test_size, valid_size)
+    os.makedirs(directory, exist_ok=True)
+    for name in names:
+        # Written under a temporary name first, so an interrupted run never leaves a partial split
+        path = os.path.join(directory, f"{name}.npy")
+        with open(f"{path}.tmp", 'wb') as file:
+            np.save(file, np.ascontiguousarray(splits[name], dtype=np.int32))
+        os.replace(f"{path}.tmp", path)
+    return splits
+
+
+def unseen(train: np.ndarray, test: np.ndarray) -> int:
+    """
+    :return: The amount of test triples with an entity or a relation that isn't in train
+    """
+    entities = np.unique(np.concatenate((train[:, 0], train[:, 2])))
+    return int((~np.isin(test[:, 0], entities) | ~np.isin(test[:, 1], train[:, 1]) |
+                ~np.isin(test[:, 2], entities)).sum())
+
+
+def same_rows(left: np.ndarray, right: np.ndarray) -> bool:
+    """
+    :return: True if both arrays hold the same triples, in any order
+    """
+    left, right = np.asarray(left, dtype=np.int64), np.asarray(right, dtype=np.int64)
+    return left.shape == right.shape and np.array_equal(left[np.lexsort(left.T[::-1])],
+                                                        right[np.lexsort(right.T[::-1])])
+
+
+def check(triples: np.ndarray, seed: int = 0, test_size: float = 0.7,
+          valid_size: float = 0.5) -> bool:
+    """
+    Verifies the splits of split_triples: both greedy splits keep every triple exactly once, the
+    part that's split off has the requested size (the second one at most) and has no entities or
+    relations that are missing in the other part
+    :param triples: The triples
+    :param seed: The seed of the splits
+    :param test_size: The fraction of all triples that's split off as train
+    :param valid_size: The fraction of the rest that becomes the test split
+    :return: True if all checks pass
+    """
+    start = time.perf_counter()
+    splits = split_triples(triples, seed, test_size, valid_size)
+    print(f"Split {len(triples)} triples in {time.perf_counter() - start:.2f} s")
+    rest = np.concatenate((splits["valid"], splits["test"]))
+    results = {
+        "train size": len(splits["train"]) == int(len(triples) * test_size),
+        "test size": len(splits["test"]) <= int(len(rest) * valid_size),
+        "train and rest hold all triples": same_rows(np.concatenate((rest, splits["train"])),
+                                                     triples),
+        "train has no unseen triples": unseen(rest, splits["train"]) == 0,
+        "test has no unseen triples": unseen(splits["valid"], splits["test"]) == 0
+    }
+    for name, passed in results.items():
+        print(f"{name}: {'ok' if passed else 'FAILED'}")
+    print({name: len(split) for name, split in splits.items()})
+    return all(results.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the cached evaluation splits or verify "
+                                                 "the splitter")
+    parser.add_argument('-relations', help="A csv or a .npy triple file", required=True,
+                        metavar="RPATH")
+    parser.add_argument('-seed', help="The seed of the splits", default=0, type=int)
+    parser.add_argument('-cache-dir', help="Directory the splits are stored in", default="splits",
+                        dest="cache_dir")
+    parser.add_argument('-check', help="Verify the sizes of the splits and that they have no "
+                                       "unseen entities instead",
+                        const=True, default=False, nargs='?')
+    args = parser.parse_args()
+
+    triples, _ = load_triples(args.relations)
+    if args.check:
+        if not check(triples, args.seed):
+            raise SystemExit(1)
+        return
+    start = time.perf_counter()
+    splits = cached_splits(triples, args.seed, args.cache_dir)
+    print({name: len(split) for name, split in splits.items()},
+          f"{time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+"""
+Measures how long the entry points take to start and how much memory they need until then.
+Every entry point is run with --help in a fresh interpreter, so nothing is shared between the
+measurements, and the modules of the entry points are imported on their own as well
+"""
+
+ENTRY_POINTS = ["insert.py", "sync_wordnet.py", "insert_bert_relations.py", "bert_parity.py",
+                "evaluate.py", "best_model.py"]
+MODULES = ["insert", "sync_wordnet", "insert_bert_relations", "bert_parity", "bert_backends",
+           "fill_multiple_mask", "ann_index"]
+
+# Runs inside the child interpreter, the timer starts before anything else is imported
+CHILD = """
+import time
+start = time.perf_counter()
+import resource, runpy, sys, json
+target, mode = sys.argv[1], sys.argv[2]
+status = "ok"
+try:
+    if mode == "script":
+        sys.argv = [target, "--help"]
+        runpy.run_path(target, run_name="__main__")
+    else:
+        __import__(target)
+except SystemExit as e:
+    if e.code not in (0, None):
+        status = f"exit {e.code}"
+except BaseException as e:
+    status = f"{type(e).__name__}: {e}"
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print("\\n" + json.dumps({"seconds": elapsed, "peak_rss_kb": rss, "status": status}))
+"""
+
+
+def measure(target: str, mode: str, framework: str = None, repeat: int = 1) -> dict:
+    """
+    :param target: The script path or module name
+    :param mode: script to run the target with --help, module to import it
+    :param framework: pt restricts transformers to PyTorch, None keeps the environment
+    :param repeat: The amount of runs, the fastest one is reported
+    :return: The seconds until the target finished, its peak RSS in MiB and whether it failed
+    """
+    env = dict(os.environ)
+    if framework == "pt":
+        env.update({"USE_TORCH": "1", "USE_TF": "0"})
+    best = None
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, "-c", CHILD, target, mode], env=env,
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__)))
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        # ru_maxrss is in KiB on linux
+        result = {"target": target, "mode": mode, "seconds": result["seconds"],
+                  "peak_rss_mb": result["peak_rss_kb"] / 1024, "status": result["status"]}
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time and peak memory of "
+                                                 "the entry points")
+    parser.add_argument('--framework', help="Restrict transformers to PyTorch",
+                        choices=["pt"], default=None)
+    parser.add_argument('--repeat', help="Runs per entry point, the fastest one is reported",
+                        default=3, type=int)
+    parser.add_argument('--output', help="Optional json file the results are written to",
+                        metavar="PATH")
+    args = parser.parse_args()
+
+    results = [measure(script, "script", args.framework, args.repeat) for script in ENTRY_POINTS]
+    results += [measure(module, "module", args.framework, args.repeat) for module in MODULES]
+    print(f"{'target':<28}{'mode':<8}{'seconds':>9}{'peak MiB':>10}  status")
+    for result in results:
+        print(f"{result['target']:<28}{result['mode']:<8}{result['seconds']:>9.2f}"
+              f"{result['peak_rss_mb']:>10.1f}  {result['status']}")
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import argparse
+import hashlib
+
+from neomodel import db
+from nltk.corpus import wordnet as wn
+
+from batch_writer import RelationshipBatchWriter
+from insert import InsertHelper, ObjectClassifier
+
+"""
+Synchronises the graph with the installed wordnet corpus by only writing the synsets, lemmas
+and relationships that differ. Every synset node stores a fingerprint of its definition and
+relationships, so unchanged synsets don't have to be compared edge by edge
+"""
+
+SYNSET_RELATIONSHIPS = ["HAS_HYPERNYM", "HAS_HYPONYM", "HAS_HOLONYM", "HAS_ROOT_HYPERNYM",
+                        "HAS_LEMMA"]
+LEMMA_RELATIONSHIPS = ["HAS_ANTONYM", "HAS_PERTAINYMS", "SUBSET_OF"]
+
+
+class WordnetSync:
+
+    def __init__(self, batch_size: int = 5000):
+        """
+        :param batch_size: The amount of nodes/relationships written per statement
+        """
+        self.batch_size = batch_size
+        self.summary = {"synsets_added": 0, "synsets_removed": 0, "synsets_changed": 0,
+                        "lemmas_added": 0, "lemmas_removed": 0, "root_words_removed": 0,
+                        "relationships_added": 0, "relationships_removed": 0,
+                        "synsets_reclassified": 0, "root_words_reclassified": 0}
+
+    @staticmethod
+    def fingerprint(synset) -> str:
+        """
+        :param synset: A wordnet synset
+        :return: A hash over the definition and all the relationships of the synset
+        """
+        digest = hashlib.sha1(synset.definition().encode())
+        for edge in sorted(InsertHelper.synset_edges(synset)):
+            digest.update(("\n" + "\t".join(edge)).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def graph_fingerprints() -> dict:
+        """
+        :return: A dict mapping the name of every synset in the db to its stored fingerprint
+        """
+        results, _ = db.cypher_query("MATCH (s:Synset) RETURN s.name, s.fingerprint")
+        return {name: fingerprint for name, fingerprint in results}
+
+    @staticmethod
+    def graph_edges(names: list) -> set:
+        """
+        Fetches all the relationships that belong to the given synsets in the same form as
+        InsertHelper.synset_edges yields them
+        :param names: The names of synsets in the db
+        :return: A set of (source_label, relation_type, target_label, source, target) tuples
+        """
+        edges = set()
+        results, _ = db.cypher_query(
+            """UNWIND $names AS name
+            MATCH (s:Synset {name: name})-[r]->(t)
+            WHERE type(r) IN $types
+            RETURN type(r), s.name, t.name""", {"names": names, "types": SYNSET_RELATIONSHIPS})
+        for relation_type, source, target in results:
+            target_label = "Lemma" if relation_type == "HAS_LEMMA" else "Synset"
+            edges.add(("Synset", relation_type, target_label, source, target))
+        results, _ = db.cypher_query(
+            """UNWIND $names AS name
+            MATCH (:Synset {name: name})-[:HAS_LEMMA]->(l:Lemma)-[r]->(t)
+            WHERE type(r) IN $types
+            RETURN type(r), l.name, t.name""", {"names": names, "types": LEMMA_RELATIONSHIPS})
+        for relation_type, source, target in results:
+            target_label = "RootWord" if relation_type == "SUBSET_OF" else "Lemma"
+            edges.add(("Lemma", relation_type, target_label, source, target))
+        results, _ = db.cypher_query(
+            """UNWIND $names AS name
+            MATCH (:Synset {name: name})-[:HAS_LEMMA]->(l:Lemma)<-[:CONTAINS]-(t:RootWord)
+            RETURN t.name, l.name""", {"names": names})
+        for source, target in results:
+            edges.add(("RootWord", "CONTAINS", "Lemma", source, target))
+        return edges
+
+    @staticmethod
+    def descendants(local: dict, names: list) -> set:
+        """
+        :param local: A dict mapping synset names to the wordnet synsets
+        :param names: The names of the synsets the search starts at
+        :return: The names of the synsets and of all their transitive hyponyms, following the
+        inverse of the hypernym relationships that classify_objects follows
+        """
+        children = {}
+        for name, synset in local.items():
+            for hypernym in synset.hypernyms():
+                children.setdefault(hypernym.name(), []).append(name)
+        found = set(names)
+        stack = list(names)
+        while len(stack) > 0:
+            for child in children.get(stack.pop(), []):
+                if child not in found:
+                    found.add(child)
+                    stack.append(child)
+        return found
+
+    def reclassify(self, local: dict, synsets: set, root_words: set) -> None:
+        """
+        Sets and removes the Object and RootWordObject labels of the given nodes the way
+        classify_objects and classify_root_word_objects would label them
+        :param local: A dict mapping synset names to the wordnet synsets
+        :param synsets: The names of the synsets whose Object label may have changed
+        :param root_words: The names of the root words whose RootWordObject label may have changed
+        """
+        classifier = ObjectClassifier()
+        is_object = {name: classifier.is_object(local[name]) for name in synsets}
+        objects = [name for name, value in is_object.items() if value]
+        others = [name for name, value in is_object.items() if not value]
+        self.run_batched("""UNWIND $names AS name
+            MATCH (s:Synset {name: name})
+            SET s:Object""", objects)
+        self.run_batched("""UNWIND $names AS name
+            MATCH (s:Object {name: name})
+            REMOVE s:Object""", others)
+        self.run_batched("""UNWIND $names AS name
+            MATCH (r:RootWord {name: name})
+            OPTIONAL MATCH (o:Object)-[:HAS_LEMMA]-(:Lemma)-[:SUBSET_OF]->(r)
+            WITH r, count(o) > 0 AS is_object
+            FOREACH (_ IN CASE WHEN is_object THEN [1] ELSE [] END | SET r:RootWordObject)
+            FOREACH (_ IN CASE WHEN is_object THEN [] ELSE [1] END | REMOVE r:RootWordObject)""",
+                         list(root_words))
+        self.summary["synsets_reclassified"] = len(synsets)
+        self.summary["root_words_reclassified"] = len(root_words)
+
+    def run_batched(self, query: str, names: list) -> None:
+        """
+        Runs a query taking a $names list for all names in chunks of the batch size
+        :param query: The cypher query
+        :param names: The names that should be passed to the query
+        """
+        for i in range(0, len(names), self.batch_size):
+            db.cypher_query(query, {"names": names[i:i + self.batch_size]})
+
+    def sync(self, wordlist: list) -> dict:
+        """
+        Compares the synsets with the db and writes only the differences
+        :param wordlist: a list of synsets
+        :return: A summary of the changes
+        """
+        stored = self.graph_fingerprints()
+        local = {synset.name(): synset for synset in wordlist}
+        fingerprints = {name: self.fingerprint(synset) for name, synset in local.items()}
+        added = [name for name in local if name not in stored]
+        removed = [name for name in stored if name not in local]
+        changed = [name for name in local if name in stored and
+                   stored[name] != fingerprints[name]]
+        self.summary["synsets_added"] = len(added)
+        self.summary["synsets_removed"] = len(removed)
+        self.summary["synsets_changed"] = len(changed)
+
+        # Collect what's stored for every synset that's touched
+        old_edges = set()
+        touched = changed + removed
+        for i in range(0, len(touched), self.batch_size):
+            old_edges |= self.graph_edges(touched[i:i + self.batch_size])
+        new_edges = set()
+        for name in added + changed:
+            new_edges.update(InsertHelper.synset_edges(local[name]))
+
+        old_lemmas = {edge[4] for edge in old_edges if edge[1] == "HAS_LEMMA"}
+        new_lemmas = {edge[4] for edge in new_edges if edge[1] == "HAS_LEMMA"}
+        removed_lemmas = list(old_lemmas - new_lemmas)
+        self.summary["lemmas_added"] = len(new_lemmas - old_lemmas)
+        self.summary["lemmas_removed"] = len(removed_lemmas)
+
+        # Nodes first, so the relationships can match both ends
+        new_synsets = [local[name] for name in added + changed]
+        for i in range(0, len(new_synsets), 400):
+            InsertHelper.batch_create_synset(new_synsets[i:i + 400])
+
+        remover = RelationshipBatchWriter(self.batch_size, delete=True)
+        for edge in old_edges - new_edges:
+            remover.add(*edge)
+        remover.flush()
+        self.summary["relationships_removed"] = remover.written
+        writer = RelationshipBatchWriter(self.batch_size)
+        for edge in new_edges - old_edges:
+            writer.add(*edge)
+        writer.flush()
+        self.summary["relationships_added"] = writer.written
+
+        self.run_batched("""UNWIND $names AS name
+            MATCH (s:Synset {name: name})
+            OPTIONAL MATCH (s)-[:HAS_LEMMA]->(l:Lemma)
+            DETACH DELETE s, l""", removed)
+        self.run_batched("""UNWIND $names AS name
+            MATCH (l:Lemma {name: name})
+            DETACH DELETE l""", removed_lemmas)
+        orphans = list({edge[4] for edge in old_edges if edge[1] == "SUBSET_OF"})
+        for i in range(0, len(orphans), self.batch_size):
+            results, _ = db.cypher_query("""UNWIND $names AS name
+                MATCH (r:RootWord {name: name})
+                WHERE NOT (r)-[:CONTAINS]->()
+                DETACH DELETE r
+                RETURN count(*)""", {"names": orphans[i:i + self.batch_size]})
+            self.summary["root_words_removed"] += results[0][0]
+
+        rows = [{"name": name, "fingerprint": fingerprints[name]} for name in added + changed]
+        for i in range(0, len(rows), self.batch_size):
+            db.cypher_query("""UNWIND $rows AS row
+                MATCH (s:Synset {name: row.name})
+                SET s.fingerprint = row.fingerprint""", {"rows": rows[i:i + self.batch_size]})
+
+        # Only the written synsets and their hyponyms can change whether they're objects, and only
+        # the root words of their lemmas or of removed lemmas whether they're object root words
+        affected = self.descendants(local, added + changed)
+        root_words = {lemma.name() for name in affected for lemma in local[name].lemmas()}
+        root_words |= {edge[4] for edge in old_edges if edge[1] == "SUBSET_OF"}
+        self.reclassify(local, affected, root_words)
+        return self.summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synchronise the database with the installed "
+                                                 "wordnet corpus by writing only the differences")
+    parser.add_argument('--batch-size', help="Amount of nodes/relationships written per statement",
+                        default=5000, type=int, dest="batch_size")
+    args = parser.parse_args()
+
+    summary = WordnetSync(args.batch_size).sync(list(wn.all_synsets()))
+    for key, value in summary.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
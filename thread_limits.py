@@ -0,0 +1,18 @@
+import os
+
+"""
+Caps the threads of the numerical libraries. The BLAS libraries of numpy read their thread count
+when they're loaded, so the limit has to be set before numpy is imported, processes forked later
+inherit it. This module doesn't import anything heavy for that reason
+"""
+
+THREAD_VARIABLES = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                    "TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS"]
+
+
+def limit_threads(threads: int) -> None:
+    """
+    :param threads: The amount of threads per process
+    """
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
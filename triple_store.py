@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+"""
+Compact binary storage of the evaluation triples and word filters. Triples are an int32 .npy
+array with one (start id, relation id, end id) row per triple and a .relations.json file holding
+the relation name of every relation id, word filters are a 1-d int32 .npy array. The .npy files
+are memory-mapped, so loading them doesn't copy or convert any data
+"""
+
+
+def relations_path(path: str) -> str:
+    """
+    :param path: A .npy triple file
+    :return: The json file holding the relation names of the relation ids used in the triples
+    """
+    return f"{os.path.splitext(path)[0]}.relations.json"
+
+
+def csv_triples(path: str):
+    """
+    Reads triples from a csv file with a start id, relation name and end id column
+    :param path: The csv file
+    :return: The int32 triples and the relation names of the relation ids
+    """
+    frame = pd.read_csv(path, delimiter=',', dtype={0: np.int32, 2: np.int32})
+    relation_ids, relation_names = pd.factorize(frame.iloc[:, 1], sort=True)
+    triples = np.empty((len(frame), 3), dtype=np.int32)
+    triples[:, 0] = frame.iloc[:, 0].values
+    triples[:, 1] = relation_ids
+    triples[:, 2] = frame.iloc[:, 2].values
+    return triples, [str(name) for name in relation_names]
+
+
+def load_triples(path: str):
+    """
+    :param path: A .npy triple file or a csv file
+    :return: The int32 triples, memory-mapped for .npy files, and the relation names of the
+    relation ids
+    """
+    if not path.endswith(".npy"):
+        return csv_triples(path)
+    with open(relations_path(path)) as file:
+        relation_names = json.load(file)
+    return np.load(path, mmap_mode='r'), relation_names
+
+
+def load_entities(path: str) -> np.ndarray:
+    """
+    :param path: A .npy word filter or a csv file with one id per line
+    :return: The int32 entity ids, memory-mapped for .npy files
+    """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode='r')
+    return pd.read_csv(path, delimiter=',', dtype=np.int32).values[:, 0]
+
+
+def save_triples(path: str, triples: np.ndarray, relation_names: list) -> None:
+    np.save(path, np.ascontiguousarray(triples, dtype=np.int32))
+    with open(relations_path(path), 'w') as file:
+        json.dump(relation_names, file)
+
+
+def convert(source: str, target: str) -> None:
+    """
+    Converts a triple or word filter csv file to the binary format
+    :param source: The csv file, files with a single column are treated as word filters
+    :param target: The .npy file that's written
+    """
+    columns = len(pd.read_csv(source, nrows=0).columns)
+    if columns == 1:
+        np.save(target, load_entities(source))
+    else:
+        save_triples(target, *csv_triples(source))
+
+
+def legacy_load(path: str) -> np.ndarray:
+    # The way evaluate.py read its inputs before the binary format existed
+    with open(path) as file:
+        data = file.read()
+        return pd.read_csv(StringIO(data), delimiter=',').values.squeeze()
+
+
+def measure(load, path: str) -> dict:
+    """
+    :param load: The function loading the file
+    :param path: The file
+    :return: The seconds and the peak of the memory allocated while loading
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    data = load(path)
+    if isinstance(data, tuple):
+        data = data[0]
+    # Touch every row, so a memory map is actually read
+    int((data[:, 0] if data.ndim == 2 else data).sum(dtype=np.int64))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": elapsed, "peak_mb": peak / 2 ** 20}
+
+
+def benchmark(paths: list) -> None:
+    """
+    Compares loading csv files the old way, parsing them into int32 and loading their binary
+    conversion. The binary files are written to a temporary directory
+    :param paths: The csv files
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        for path in paths:
+            target = os.path.join(directory, os.path.basename(path) + ".npy")
+            convert(path, target)
+            load = load_entities if len(pd.read_csv(path, nrows=0).columns) == 1 else \
+                load_triples
+            results = {"csv (StringIO)": measure(legacy_load, path),
+                       "csv (int32)": measure(load, path),
+                       "npy (mmap)": measure(load, target)}
+            print(path)
+            for name, result in results.items():
+                print(f"  {name:<16}{result['seconds']:>9.4f} s{result['peak_mb']:>10.2f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the evaluation csv files to the binary "
+                                                 "triple format or benchmark loading them")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="Convert a triple or word filter csv")
+    convert_parser.add_argument("source", help="The csv file")
+    convert_parser.add_argument("target", help="The .npy file that's written")
+    benchmark_parser = subparsers.add_parser("benchmark", help="Compare the load time and peak "
+                                                               "memory of csv and npy")
+    benchmark_parser.add_argument("paths", nargs="+", help="The csv files")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        convert(args.source, args.target)
+    else:
+        benchmark(args.paths)
+
+
+if __name__ == "__main__":
+    main()